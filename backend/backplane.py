@@ -0,0 +1,193 @@
+"""
+跨进程广播通道（backplane）
+
+ConnectionManager 只持有本进程的WebSocket连接。多个uvicorn worker同时运行时，
+每个worker把房间事件发布到backplane，再由backplane投递给其他worker，
+各worker只负责把事件推送给自己的连接。
+
+- LocalBackplane：单进程部署使用，不做任何转发
+- UnixSocketBackplane：同一台机器上的多个worker通过Unix socket互通，
+  抢到文件锁的worker充当转发中心，该worker退出后由其他worker接替
+
+其他实现（例如Redis）只需要实现 Backplane 的 start / publish / stop。
+"""
+
+import os
+import fcntl
+import asyncio
+from typing import Callable, Optional, Set, Tuple
+
+from serialization import encode_json_bytes, decode_json
+
+BACKPLANE = os.getenv("BACKPLANE", "local")
+BACKPLANE_SOCKET = os.getenv("BACKPLANE_SOCKET", "/tmp/todo-backplane.sock")
+# 与转发中心断开后的重连间隔（秒）
+BACKPLANE_RETRY_INTERVAL = float(os.getenv("BACKPLANE_RETRY_INTERVAL", "0.5"))
+# 转发中心对单个worker的写缓冲上限，超过时断开该worker，由其重连
+BACKPLANE_MAX_BUFFER = int(os.getenv("BACKPLANE_MAX_BUFFER", str(8 * 1024 * 1024)))
+# 单条消息的最大长度
+BACKPLANE_MAX_MESSAGE = 16 * 1024 * 1024
+
+# 事件序号 (prev_seq, seq)，没有序号的消息（聊天、上下线）为None
+EventSeq = Optional[Tuple[int, int]]
+# 收到其他worker的房间事件时调用：handler(room_id, frame, key, seq)
+MessageHandler = Callable[[str, str, Optional[str], EventSeq], None]
+
+
+class Backplane:
+    """backplane接口，默认实现即单进程模式"""
+
+    async def start(self, handler: MessageHandler):
+        self._handler = handler
+
+    async def publish(self, room_id: str, frame: str, key: Optional[str] = None, seq: EventSeq = None):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class LocalBackplane(Backplane):
+    pass
+
+
+class UnixSocketBackplane(Backplane):
+    """通过Unix socket在同机worker之间转发房间事件
+
+    每条消息是一行JSON：{"room": room_id, "key": key, "seq": [prev_seq, seq] 或 null, "frame": frame}。
+    room_id来自URL，可能包含制表符、换行等任意字符，JSON编码保证它们不会破坏行边界。
+    """
+
+    def __init__(self, path: str = BACKPLANE_SOCKET):
+        self.path = path
+        self.is_hub = False
+        self._handler: Optional[MessageHandler] = None
+        self._lock_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: MessageHandler):
+        self._handler = handler
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if self._server:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            self._server = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_hub = False
+
+    async def publish(self, room_id: str, frame: str, key: Optional[str] = None, seq: EventSeq = None):
+        writer = self._writer
+        if writer is None or writer.is_closing():
+            # 与转发中心断开期间的事件不会送达其他worker，客户端靠增量同步补齐
+            return
+        message = {"room": room_id, "key": key, "seq": list(seq) if seq else None, "frame": frame}
+        writer.write(encode_json_bytes(message) + b"\n")
+
+    async def _run(self):
+        while True:
+            await self._try_become_hub()
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.path, limit=BACKPLANE_MAX_MESSAGE
+                )
+            except OSError:
+                await asyncio.sleep(BACKPLANE_RETRY_INTERVAL)
+                continue
+            self._writer = writer
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self._dispatch(line)
+            except (ConnectionError, ValueError):
+                pass
+            finally:
+                self._writer = None
+                writer.close()
+            await asyncio.sleep(BACKPLANE_RETRY_INTERVAL)
+
+    def _dispatch(self, line: bytes):
+        # 格式错误的消息只丢弃这一条，不影响与转发中心的连接
+        try:
+            message = decode_json(line)
+            room_id, key, frame = message["room"], message["key"], message["frame"]
+            if not isinstance(room_id, str) or not isinstance(frame, str) or not isinstance(key, (str, type(None))):
+                raise ValueError("字段类型错误")
+            seq = message["seq"]
+            if seq is not None:
+                prev_seq, last_seq = seq
+                seq = (int(prev_seq), int(last_seq))
+        except (ValueError, TypeError, KeyError) as e:
+            print(f"backplane消息格式错误，已丢弃: {e}")
+            return
+        try:
+            self._handler(room_id, frame, key or None, seq)
+        except Exception as e:
+            print(f"backplane消息处理失败: {e}")
+
+    async def _try_become_hub(self):
+        """抢到文件锁的worker启动转发中心；锁随进程退出自动释放"""
+        if self.is_hub:
+            return
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return
+        # 上一个转发中心异常退出时会留下socket文件
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(
+            self._serve_peer, path=self.path, limit=BACKPLANE_MAX_MESSAGE
+        )
+        self._lock_file = lock_file
+        self.is_hub = True
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for peer in list(self._peers):
+                    if peer is writer:
+                        continue
+                    if peer.transport.get_write_buffer_size() > BACKPLANE_MAX_BUFFER:
+                        peer.close()
+                        self._peers.discard(peer)
+                        continue
+                    peer.write(line)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+
+def create_backplane(kind: str = BACKPLANE) -> Backplane:
+    if kind == "local":
+        return LocalBackplane()
+    if kind == "unix":
+        return UnixSocketBackplane()
+    raise ValueError(f"未知的backplane类型: {kind}")
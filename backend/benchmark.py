@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+后端压测和基准测试
+
+在本机启动一个使用临时数据库的服务进程，预先写入指定数量的房间和任务，然后按房间模拟：
+- N 个轮询客户端：带ETag轮询任务列表，按比例混合创建、切换完成、更新、删除操作
+- M 个WebSocket客户端：接收广播，统计从写请求发出到收到事件的延迟
+
+结束后输出吞吐量、每个接口的 p50/p95/p99 延迟、广播延迟和服务端 Database 方法的耗时，
+并保存为JSON，用 compare 对比两次结果。全部在本机离线运行，不依赖requirements.txt以外的包。
+
+    python benchmark.py run --rooms 20 --tasks-per-room 200 --pollers 3 --ws-clients 5 --duration 30
+    python benchmark.py run --output before.json
+    DB_GROUP_COMMIT=1 python benchmark.py run --output after.json
+    python benchmark.py compare before.json after.json
+
+服务进程继承当前环境变量，可以用同样的方式对比 DATABASE_SHARDS、DB_READER_POOL_SIZE 等配置。
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# 结果中记录的服务端配置（环境变量前缀）
+CONFIG_ENV_PREFIXES = ("DB_", "DATABASE_", "WS_", "ROOM_", "BACKPLANE")
+# 默认操作比例
+DEFAULT_MIX = "poll=60,create=15,toggle=12,update=8,delete=5"
+# 服务端 Database 方法耗时取自 /metrics 中的这个直方图（见 metrics.instrument_queries）
+DB_QUERY_METRIC = "todo_db_query_duration_seconds"
+_METRIC_LINE = re.compile(r'^(\w+)\{query="([^"]*)"(?:,le="([^"]*)")?\} (\S+)$')
+
+
+# ---------------------------------------------------------------- 服务端
+
+def read_db_metrics(text: str) -> Dict[str, Dict[str, Any]]:
+    """从 /metrics 的输出中取出每个 Database 方法的调用次数、总耗时和累计桶计数"""
+    stats: Dict[str, Dict[str, Any]] = {}
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if not match or not match.group(1).startswith(DB_QUERY_METRIC):
+            continue
+        name, query, le, value = match.groups()
+        entry = stats.setdefault(query, {"calls": 0, "total": 0.0, "buckets": {}})
+        if name == DB_QUERY_METRIC + "_bucket":
+            entry["buckets"][float(le)] = int(value)
+        elif name == DB_QUERY_METRIC + "_sum":
+            entry["total"] = float(value)
+        elif name == DB_QUERY_METRIC + "_count":
+            entry["calls"] = int(value)
+    return stats
+
+
+def diff_db_metrics(before: Dict[str, Dict[str, Any]], after: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """压测窗口内的增量；p95按直方图桶的上界估算"""
+    stats = {}
+    for query, entry in after.items():
+        old = before.get(query, {"calls": 0, "total": 0.0, "buckets": {}})
+        calls = entry["calls"] - old["calls"]
+        if calls <= 0:
+            continue
+        p95 = None
+        for bound, count in sorted(entry["buckets"].items()):
+            if count - old["buckets"].get(bound, 0) >= calls * 0.95:
+                p95 = bound
+                break
+        stats[query] = {"calls": calls, "total": entry["total"] - old["total"], "p95": p95}
+    return stats
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, database: str, log_path: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = database
+    # 压测期间不跑后台维护，避免干扰结果
+    env.setdefault("MAINTENANCE_INTERVAL", "0")
+    env["PYTHONUNBUFFERED"] = "1"
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log,
+    )
+
+
+# ---------------------------------------------------------------- HTTP客户端
+
+class HttpClient:
+    """最小的HTTP/1.1 keep-alive客户端，一个实例对应一个连接，同一时间只发一个请求"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def close(self):
+        if self._writer:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def request(
+        self, method: str, path: str, body: Any = None, headers: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        payload = json.dumps(body).encode() if body is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(payload)}"]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines.extend(f"{key}: {value}" for key, value in (headers or {}).items())
+        raw = ("\r\n".join(lines) + "\r\n\r\n").encode() + payload
+        for attempt in range(2):
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self._writer.write(raw)
+                await self._writer.drain()
+                return await self._read_response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # 服务端关闭了空闲的keep-alive连接，重连一次
+                await self.close()
+                if attempt:
+                    raise
+
+    async def _read_response(self) -> Tuple[int, Dict[str, str], bytes]:
+        status_line = await self._reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        if "content-length" in headers:
+            body = await self._reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            body = b""
+            while True:
+                size = int((await self._reader.readuntil(b"\r\n")).strip(), 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        else:
+            body = b""
+        if headers.get("connection") == "close":
+            await self.close()
+        return status, headers, body
+
+
+# ---------------------------------------------------------------- 统计
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    """延迟分布（毫秒）"""
+    ms = [value * 1000 for value in values]
+    return {
+        "count": len(ms),
+        "mean": round(sum(ms) / len(ms), 3) if ms else None,
+        "p50": round(percentile(ms, 50), 3) if ms else None,
+        "p95": round(percentile(ms, 95), 3) if ms else None,
+        "p99": round(percentile(ms, 99), 3) if ms else None,
+        "max": round(max(ms), 3) if ms else None,
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        # (房间, 事件类型, 任务id) -> [(写请求发出的时间, 是否计入结果)]
+        self.sent: Dict[Tuple[str, str, int], List[Tuple[float, bool]]] = {}
+        self.recording = False
+
+    def request(self, label: str, elapsed: float, ok: bool):
+        if not self.recording:
+            return
+        self.latencies.setdefault(label, []).append(elapsed)
+        if not ok:
+            self.errors[label] = self.errors.get(label, 0) + 1
+
+    def broadcast_sent(self, room_id: str, event: str, task_id: int, started: float):
+        # 预热和收尾阶段的写操作也要记下，才能和监听者收到的事件一一对应
+        self.sent.setdefault((room_id, event, task_id), []).append((started, self.recording))
+
+
+# ---------------------------------------------------------------- 模拟客户端
+
+class Room:
+    def __init__(self, token: str, task_ids: List[int]):
+        self.token = token
+        self.task_ids = task_ids
+        self.listeners: List["Listener"] = []
+
+
+class Listener:
+    """WebSocket客户端：记录每个任务事件的到达时间"""
+
+    def __init__(self, room: Room, name: str):
+        self.room = room
+        self.name = name
+        self.received: Dict[Tuple[str, int], List[float]] = {}
+        self.ready = asyncio.Event()
+
+    async def run(self, url: str, stop: asyncio.Event):
+        import websockets
+
+        async with websockets.connect(f"{url}/ws/{self.room.token}/{self.name}", max_size=None) as ws:
+            self.ready.set()
+            last_ping = time.perf_counter()
+            while not stop.is_set():
+                try:
+                    frame = await asyncio.wait_for(ws.recv(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    frame = None
+                now = time.perf_counter()
+                if now - last_ping > 20:
+                    await ws.send("ping")
+                    last_ping = now
+                if not frame or not frame.startswith("{"):
+                    continue
+                self.record(json.loads(frame), now)
+
+    def record(self, message: Dict[str, Any], now: float):
+        kind = message.get("type")
+        if kind in ("task_created", "task_updated", "task_restored"):
+            key = (kind, message["task"]["id"])
+        elif kind == "task_deleted":
+            key = (kind, message["task_id"])
+        else:
+            return
+        self.received.setdefault(key, []).append(now)
+
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("poll", "create", "toggle", "update", "delete"):
+            raise ValueError(f"未知的操作: {name}")
+        mix.append((name, float(weight)))
+    return mix
+
+
+async def poller(client: HttpClient, room: Room, user: str, mix, recorder: Recorder, stop: asyncio.Event, think: float):
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    etag = None
+    counter = 0
+    while not stop.is_set():
+        op = random.choices(names, weights)[0]
+        if op != "poll" and op != "create" and not room.task_ids:
+            op = "create"
+        started = time.perf_counter()
+        ok = True
+        if op == "poll":
+            label = "GET /rooms/{room_id}/tasks"
+            status, headers, _ = await client.request(
+                "GET", f"/rooms/{room.token}/tasks", headers={"If-None-Match": etag} if etag else None
+            )
+            ok = status in (200, 304)
+            etag = headers.get("etag", etag)
+        elif op == "create":
+            label = "POST /tasks"
+            counter += 1
+            status, _, body = await client.request("POST", "/tasks", {
+                "text": f"{user} task {counter}", "creator": user, "room_id": room.token,
+                "priority": random.choice(["low", "medium", "high"]), "tags": random.sample(["a", "b", "c", "d"], 2),
+            })
+            ok = status == 200
+            if ok:
+                task_id = json.loads(body)["id"]
+                room.task_ids.append(task_id)
+                recorder.broadcast_sent(room.token, "task_created", task_id, started)
+        else:
+            task_id = random.choice(room.task_ids)
+            if op == "toggle":
+                label = "PATCH /tasks/{task_id}/toggle"
+                status, _, _ = await client.request("PATCH", f"/tasks/{task_id}/toggle")
+                event = "task_updated"
+            elif op == "update":
+                label = "PUT /tasks/{task_id}"
+                status, _, _ = await client.request(
+                    "PUT", f"/tasks/{task_id}", {"text": f"{user} edit {counter}", "description": "benchmark"}
+                )
+                event = "task_updated"
+            else:
+                label = "DELETE /tasks/{task_id}"
+                if task_id in room.task_ids:
+                    room.task_ids.remove(task_id)
+                status, _, _ = await client.request("DELETE", f"/tasks/{task_id}")
+                event = "task_deleted"
+            ok = status == 200
+            if ok:
+                recorder.broadcast_sent(room.token, event, task_id, started)
+        recorder.request(label, time.perf_counter() - started, ok)
+        if think:
+            await asyncio.sleep(think)
+
+
+def broadcast_latencies(rooms: List[Room], recorder: Recorder) -> Tuple[List[float], int]:
+    """把每个监听者收到的事件和写请求按发出顺序配对，返回延迟和未收到的事件数"""
+    latencies = []
+    missing = 0
+    by_room = {room.token: room for room in rooms}
+    for (room_id, event, task_id), sent in recorder.sent.items():
+        sent = sorted(sent)
+        for listener in by_room[room_id].listeners:
+            received = listener.received.get((event, task_id), [])
+            for index, (started, counted) in enumerate(sent):
+                if not counted:
+                    continue
+                if index < len(received):
+                    latencies.append(max(0.0, received[index] - started))
+                else:
+                    missing += 1
+    return latencies, missing
+
+
+# ---------------------------------------------------------------- 压测流程
+
+async def seed(client: HttpClient, rooms: int, tasks_per_room: int) -> List[Room]:
+    seeded = []
+    for index in range(rooms):
+        status, _, body = await client.request("POST", "/rooms/create")
+        if status != 200:
+            raise RuntimeError(f"创建房间失败: {status} {body[:200]!r}")
+        token = json.loads(body)["token"]
+        task_ids = []
+        for start in range(0, tasks_per_room, 1000):
+            operations = [
+                {"op": "create", "text": f"seed {index}-{n}", "creator": "seed",
+                 "priority": random.choice(["low", "medium", "high", "urgent"]),
+                 "tags": random.sample(["a", "b", "c", "d", "e"], 2), "completed": n % 3 == 0}
+                for n in range(start, min(tasks_per_room, start + 1000))
+            ]
+            status, _, body = await client.request("POST", f"/rooms/{token}/tasks/batch", {"operations": operations})
+            if status != 200:
+                raise RuntimeError(f"写入任务失败: {status} {body[:200]!r}")
+            task_ids.extend(result["task_id"] for result in json.loads(body)["results"])
+        seeded.append(Room(token, task_ids))
+    return seeded
+
+
+async def wait_ready(client: HttpClient, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("服务进程启动失败")
+        try:
+            status, _, _ = await client.request("GET", "/maintenance/status")
+            if status == 200:
+                return
+        except OSError:
+            await client.close()
+        await asyncio.sleep(0.2)
+    raise RuntimeError("等待服务启动超时")
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix="todo-bench-")
+    database = args.database or os.path.join(workdir, "bench.db")
+    port = free_port()
+    log_path = os.path.join(workdir, "server.log")
+    process = start_server(port, database, log_path)
+    control = HttpClient("127.0.0.1", port)
+    try:
+        await wait_ready(control, process)
+        print(f"服务已启动（端口 {port}，数据库 {database}），正在写入 {args.rooms} 个房间 × {args.tasks_per_room} 个任务")
+        seed_started = time.perf_counter()
+        rooms = await seed(control, args.rooms, args.tasks_per_room)
+        seed_time = time.perf_counter() - seed_started
+
+        recorder = Recorder()
+        stop = asyncio.Event()
+        url = f"ws://127.0.0.1:{port}"
+        listener_tasks = []
+        for room in rooms:
+            for n in range(args.ws_clients):
+                listener = Listener(room, f"listener{n}")
+                room.listeners.append(listener)
+                listener_tasks.append(asyncio.create_task(listener.run(url, stop)))
+        await asyncio.wait_for(
+            asyncio.gather(*(listener.ready.wait() for room in rooms for listener in room.listeners)), 30
+        )
+
+        clients = [HttpClient("127.0.0.1", port) for _ in range(args.rooms * args.pollers)]
+        workers = [
+            asyncio.create_task(poller(clients[r * args.pollers + n], room, f"user{n}", mix, recorder, stop, args.think_ms / 1000))
+            for r, room in enumerate(rooms) for n in range(args.pollers)
+        ]
+        print(f"预热 {args.warmup}s，压测 {args.duration}s：{len(workers)} 个HTTP客户端，{len(listener_tasks)} 个WebSocket客户端")
+        await asyncio.sleep(args.warmup)
+        _, _, body = await control.request("GET", "/metrics")
+        db_before = read_db_metrics(body.decode())
+        recorder.recording = True
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        recorder.recording = False
+        elapsed = time.perf_counter() - started
+        _, _, body = await control.request("GET", "/metrics")
+        db_stats = diff_db_metrics(db_before, read_db_metrics(body.decode()))
+
+        # 给在途的广播一点时间到达
+        await asyncio.sleep(args.drain)
+        stop.set()
+        results = await asyncio.gather(*workers, *listener_tasks, return_exceptions=True)
+        failures = [r for r in results if isinstance(r, BaseException)]
+        for client in clients:
+            await client.close()
+    finally:
+        await control.close()
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    if failures:
+        print(f"有 {len(failures)} 个客户端异常退出，第一个: {failures[0]!r}；服务日志: {log_path}")
+
+    total = sum(len(values) for values in recorder.latencies.values())
+    errors = sum(recorder.errors.values())
+    broadcast, missing = broadcast_latencies(rooms, recorder)
+    db_total = sum(entry["total"] for entry in db_stats.values())
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "rooms": args.rooms,
+            "tasks_per_room": args.tasks_per_room,
+            "pollers": args.pollers,
+            "ws_clients": args.ws_clients,
+            "duration": args.duration,
+            "think_ms": args.think_ms,
+            "mix": args.mix,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+            "cpus": os.cpu_count(),
+            "env": {key: value for key, value in sorted(os.environ.items()) if key.startswith(CONFIG_ENV_PREFIXES)},
+        },
+        "seed_seconds": round(seed_time, 3),
+        "elapsed": round(elapsed, 3),
+        "requests": total,
+        "errors": errors,
+        "client_failures": len(failures),
+        "throughput": round(total / elapsed, 2) if elapsed else 0,
+        "endpoints": {
+            label: {**summarize(values), "errors": recorder.errors.get(label, 0), "throughput": round(len(values) / elapsed, 2)}
+            for label, values in sorted(recorder.latencies.items())
+        },
+        "broadcast": {**summarize(broadcast), "missing": missing},
+        "db": {
+            "total_ms": round(db_total * 1000, 3),
+            # 平均同时在执行的Database调用数（含等待连接和写锁），大于1说明调用在排队或并发
+            "concurrency": round(db_total / elapsed, 3) if elapsed else None,
+            "methods": {
+                name: {
+                    "calls": entry["calls"],
+                    "total_ms": round(entry["total"] * 1000, 3),
+                    "mean_ms": round(entry["total"] / entry["calls"] * 1000, 3),
+                    # 直方图桶的上界，超过最大的桶时为None
+                    "p95_ms": None if entry["p95"] in (None, float("inf")) else round(entry["p95"] * 1000, 3),
+                }
+                for name, entry in sorted(db_stats.items(), key=lambda item: -item[1]["total"])
+            },
+        },
+    }
+
+
+def fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\n总请求 {result['requests']}，错误 {result['errors']}，吞吐量 {result['throughput']} req/s（{result['elapsed']}s）")
+    print(f"{'接口':<34}{'次数':>8}{'错误':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for label, entry in result["endpoints"].items():
+        print(f"{label:<34}{entry['count']:>8}{entry['errors']:>6}{entry['throughput']:>9}"
+              f"{fmt(entry['p50']):>9}{fmt(entry['p95']):>9}{fmt(entry['p99']):>9}{fmt(entry['max']):>9}")
+    b = result["broadcast"]
+    print(f"{'广播（写请求 -> WebSocket收到）':<34}{b['count']:>8}{b['missing']:>6}{'':>9}"
+          f"{fmt(b['p50']):>9}{fmt(b['p95']):>9}{fmt(b['p99']):>9}{fmt(b['max']):>9}")
+    db = result["db"]
+    print(f"\nDatabase 方法耗时合计 {db['total_ms']:.1f}ms，平均同时进行 {db['concurrency']} 个调用")
+    for name, entry in list(db["methods"].items())[:10]:
+        print(f"  {name:<28}{entry['calls']:>8} 次  平均 {entry['mean_ms']:.3f}ms  p95 ≤ {fmt(entry['p95_ms'])}ms")
+
+
+def change(old: Optional[float], new: Optional[float]) -> str:
+    if old is None or new is None:
+        return "-"
+    if not old:
+        return f"{new:.2f}"
+    return f"{new:.2f} ({(new - old) / old * 100:+.1f}%)"
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"吞吐量: {old['throughput']} -> {change(old['throughput'], new['throughput'])} req/s")
+    rows = [(label, old["endpoints"].get(label, {}), new["endpoints"].get(label, {}))
+            for label in sorted(set(old["endpoints"]) | set(new["endpoints"]))]
+    rows.append(("broadcast", old["broadcast"], new["broadcast"]))
+    for label, before, after in rows:
+        print(f"{label:<34}" + "  ".join(
+            f"{key} {fmt(before.get(key))} -> {change(before.get(key), after.get(key))}" for key in ("p50", "p95", "p99")
+        ))
+    print(f"Database 耗时: {old['db']['total_ms']}ms -> {change(old['db']['total_ms'], new['db']['total_ms'])}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Todo后端压测")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="启动临时服务并压测")
+    run.add_argument("--rooms", type=int, default=10)
+    run.add_argument("--tasks-per-room", type=int, default=200)
+    run.add_argument("--pollers", type=int, default=2, help="每个房间的HTTP客户端数")
+    run.add_argument("--ws-clients", type=int, default=3, help="每个房间的WebSocket客户端数")
+    run.add_argument("--duration", type=float, default=20, help="压测时长（秒）")
+    run.add_argument("--warmup", type=float, default=2, help="不计入结果的预热时长（秒）")
+    run.add_argument("--drain", type=float, default=1, help="结束后等待在途广播的时间（秒）")
+    run.add_argument("--think-ms", type=float, default=0, help="每个客户端两次请求之间的间隔（毫秒）")
+    run.add_argument("--mix", default=DEFAULT_MIX, help=f"操作比例，默认 {DEFAULT_MIX}")
+    run.add_argument("--seed", type=int, default=1, help="随机数种子")
+    run.add_argument("--database", help="数据库文件路径，默认使用临时目录")
+    run.add_argument("--output", help="保存结果的JSON文件")
+
+    cmp = commands.add_parser("compare", help="对比两次压测结果")
+    cmp.add_argument("old")
+    cmp.add_argument("new")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare(args.old, args.new)
+    else:
+        result = asyncio.run(run_benchmark(args))
+        print_report(result)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+房间任务列表缓存
+
+缓存每个房间任务列表编码好的响应体（只保存响应体，不保留任务对象），按房间版本号（room_revs.rev）校验：
+版本号一致才算命中，所以多个worker各自缓存也不会读到旧数据。
+写操作后调用 invalidate 主动丢弃本进程的缓存；超出内存预算时淘汰最久未访问的房间。
+"""
+
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from models import Task
+from serialization import encode_json_bytes
+
+# 缓存内存预算（字节），0表示关闭缓存
+ROOM_CACHE_MAX_BYTES = int(os.getenv("ROOM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 缓存的列表类型：房间任务列表和垃圾桶
+LIST_KINDS = ("tasks", "trash")
+
+
+class CacheEntry:
+    __slots__ = ("rev", "body", "size")
+
+    def __init__(self, rev: int, body: bytes):
+        self.rev = rev
+        self.body = body
+        self.size = len(body)
+
+
+class RoomCache:
+    """按 (room_id, 列表类型) 缓存的LRU"""
+
+    def __init__(self, max_bytes: int = ROOM_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, room_id: str, kind: str, rev: int) -> Optional[CacheEntry]:
+        key = (room_id, kind)
+        entry = self._entries.get(key)
+        if entry is None or entry.rev != rev:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, room_id: str, kind: str, rev: int, tasks: List[Task]) -> CacheEntry:
+        entry = CacheEntry(rev, encode_json_bytes(tasks))
+        if not self.enabled or entry.size > self.max_bytes:
+            return entry
+        key = (room_id, kind)
+        self._discard(key)
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+        return entry
+
+    def invalidate(self, room_id: str):
+        for kind in LIST_KINDS:
+            self._discard((room_id, kind))
+
+    def _discard(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,144 +1,649 @@
+import os
+import json
+import time
+import base64
+import asyncio
 import aiosqlite
+import metrics
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Optional
-from models import Task, Room
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from itertools import groupby
+from models import (
+    Room, TaskChanges, BatchOperationType, TaskBatchOperation, TaskBatchResult, TagCount,
+    Priority, TaskSort, SortOrder, TaskSearchHit, TaskSearchResults, TaskImport, construct
+)
+from records import TaskRecord, TASK_FIELDS
+from migrations import migrate, PRIORITY_RANK_SQL, DUE_SORT_SQL, UPDATED_SORT_SQL
+from write_queue import WriteQueue, WriteOp, DB_GROUP_COMMIT
+from sharding import DATABASE_SHARDS, ShardRing, shard_path, shard_id_base, task_shard_index
+
+# 兼容 sqlite:///./todo.db 形式的配置
+DATABASE_URL = os.getenv("DATABASE_URL", "todo.db").replace("sqlite:///", "", 1)
+
+# 连接池配置
+DB_READER_POOL_SIZE = int(os.getenv("DB_READER_POOL_SIZE", "4"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+
+
+class ConnectionPool:
+    """SQLite连接池：一个专用写连接 + 若干只读连接，运行在WAL模式下"""
+
+    def __init__(self, path: str, readers: int = DB_READER_POOL_SIZE, name: str = "0"):
+        self.path = path
+        # 指标中的分片标签
+        self.name = name
+        self.size = max(1, readers)
+        self._readers: Optional[asyncio.Queue] = None
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._connections: List[aiosqlite.Connection] = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    @property
+    def readers_in_use(self) -> int:
+        return self.size - self._readers.qsize() if self.is_open else 0
+
+    @property
+    def writer_busy(self) -> bool:
+        return self.is_open and self._write_lock.locked()
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.path)
+        db.row_factory = aiosqlite.Row
+        # 部分PRAGMA会返回结果行，必须取完，否则语句不会结束并一直持有锁
+        await db.execute_fetchall(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+        await db.execute_fetchall(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+        # 负数表示以KiB为单位
+        await db.execute_fetchall(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        await db.execute_fetchall(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        await db.execute_fetchall("PRAGMA temp_store = MEMORY")
+        if read_only:
+            await db.execute_fetchall("PRAGMA query_only = 1")
+        self._connections.append(db)
+        return db
+
+    async def open(self):
+        if self.is_open:
+            return
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        # journal_mode是持久化到数据库文件的，由写连接设置一次即可
+        self._writer = await self._connect()
+        await self._writer.execute_fetchall("PRAGMA journal_mode = WAL")
+        for _ in range(self.size):
+            self._readers.put_nowait(await self._connect(read_only=True))
+
+    async def close(self):
+        connections, self._connections = self._connections, []
+        self._writer = None
+        self._readers = None
+        for db in connections:
+            await db.close()
+
+    @asynccontextmanager
+    async def reader(self):
+        """借出一个只读连接，用完自动归还"""
+        if not self.is_open:
+            raise RuntimeError("数据库连接池未初始化")
+        start = time.perf_counter()
+        db = await self._readers.get()
+        metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start, self.name, "reader")
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def writer(self):
+        """独占写连接；出错时回滚未提交的事务"""
+        if not self.is_open:
+            raise RuntimeError("数据库连接池未初始化")
+        start = time.perf_counter()
+        async with self._write_lock:
+            metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start, self.name, "writer")
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+
+class Shard:
+    """一个数据库分片：文件路径、连接池和写队列"""
+
+    def __init__(self, index: int, path: str):
+        self.index = index
+        self.path = path
+        self.pool = ConnectionPool(path, name=str(index))
+        # 开启DB_GROUP_COMMIT后，写操作通过写队列合并提交
+        self.write_queue = WriteQueue(self.pool)
+
+
+shards = [Shard(index, shard_path(DATABASE_URL, index)) for index in range(DATABASE_SHARDS)]
+shard_ring = ShardRing(DATABASE_SHARDS)
+
+
+def room_shard(room_id: str) -> Shard:
+    """房间所在的分片"""
+    return shards[shard_ring.shard_for(room_id)]
+
+
+def task_shard(task_id: int) -> Optional[Shard]:
+    """从任务id算出所在的分片；不属于任何分片的id返回None"""
+    index = task_shard_index(task_id)
+    return shards[index] if 0 <= index < len(shards) else None
+
+
+def _encode_tags(tags: Optional[List[str]]) -> str:
+    return json.dumps(tags or [], ensure_ascii=False)
+
+
+# 所有读取路径共用的行解码器
+_task_from_row = TaskRecord.from_row
+
+
+# 排序字段对应的SQL表达式和默认方向
+_SORT_SQL = {
+    TaskSort.CREATED_AT: ("created_at", SortOrder.DESC),
+    TaskSort.DUE_DATE: (DUE_SORT_SQL, SortOrder.ASC),
+    TaskSort.PRIORITY: (PRIORITY_RANK_SQL, SortOrder.DESC),
+    TaskSort.UPDATED_AT: (UPDATED_SORT_SQL, SortOrder.DESC),
+}
+
+
+def _keyset_condition(sort_sql: str, descending: bool) -> str:
+    """游标之后的行：(排序值, id) 严格在游标之后
+
+    SQLite不会用行值比较在表达式索引上定位起点，深翻页时会从头扫描；
+    前面单独加一个排序值的范围条件，索引就能直接跳到游标位置。参数依次为 (排序值, 排序值, id)。
+    """
+    op = "<" if descending else ">"
+    return f"{sort_sql} {op}= ? AND ({sort_sql}, id) {op} (?, ?)"
+
+
+_PRIORITY_RANK = {Priority.LOW: 0, Priority.MEDIUM: 1, Priority.HIGH: 2, Priority.URGENT: 3}
+
+
+def _sort_value(task: TaskRecord, sort: TaskSort):
+    """任务在给定排序下的排序键，与_SORT_SQL中的表达式取值一致"""
+    if sort == TaskSort.DUE_DATE:
+        return task.due_date or '9999-12-31T23:59:59'
+    if sort == TaskSort.PRIORITY:
+        return _PRIORITY_RANK.get(task.priority, 1)
+    if sort == TaskSort.UPDATED_AT:
+        return task.updated_at or task.created_at
+    return task.created_at
+
+
+def encode_task_cursor(task: TaskRecord, sort: TaskSort = TaskSort.CREATED_AT) -> str:
+    """分页游标：上一页最后一个任务的排序键和id"""
+    raw = json.dumps([_sort_value(task, sort), task.id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_task_cursor(cursor: str):
+    try:
+        value, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("无效的分页游标")
+    # 游标来自客户端，排序值会原样作为SQL参数，只接受排序键可能的类型
+    if isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))):
+        raise ValueError("无效的分页游标")
+    if isinstance(task_id, bool) or not isinstance(task_id, int):
+        raise ValueError("无效的分页游标")
+    return value, task_id
+
+
+# 全文搜索：命中片段的标记和长度（词元数）
+SEARCH_HIGHLIGHT = ("<mark>", "</mark>")
+SEARCH_SNIPPET_TOKENS = 32
+# trigram分词下，短于3个字符的词无法走全文索引
+_SEARCH_MIN_TERM = 3
+
+
+def _search_terms(q: str) -> List[str]:
+    return [term for term in q.split() if term]
+
+
+def _fts_query(terms: List[str]) -> str:
+    """把用户输入当作字面量：每个词加引号，词之间为AND"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _chunks(items: list, size: int = 500):
+    """IN查询的参数分块，避免超过SQLite的变量数量上限"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def _room_seq(db, room_id: str) -> int:
+    """房间当前的事件序号"""
+    cursor = await db.execute("SELECT seq FROM room_revs WHERE room_id = ?", (room_id,))
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row['seq'] if row else 0
+
+
+async def _remove_tasks(db, rows) -> Dict[str, Tuple[List[int], Tuple[int, int]]]:
+    """永久删除给定的任务行 (id, room_id)，返回每个房间被删除的id和删除前后的事件序号"""
+    by_room: Dict[str, List[int]] = {}
+    for row in rows:
+        by_room.setdefault(row['room_id'], []).append(row['id'])
+    before = {room_id: await _room_seq(db, room_id) for room_id in by_room}
+    for chunk in _chunks([row['id'] for row in rows]):
+        await db.execute(f"DELETE FROM tasks WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+    return {
+        room_id: (task_ids, (before[room_id], await _room_seq(db, room_id)))
+        for room_id, task_ids in by_room.items()
+    }
+
+
+async def _existing_task_ids(db, room_id: str, task_ids) -> set:
+    existing = set()
+    for chunk in _chunks(list(task_ids)):
+        placeholders = ", ".join("?" * len(chunk))
+        cursor = await db.execute(
+            f"SELECT id FROM tasks WHERE room_id = ? AND id IN ({placeholders})",
+            (room_id, *chunk)
+        )
+        existing.update(row['id'] for row in await cursor.fetchall())
+    return existing
 
-DATABASE_URL = "todo.db"
 
 class Database:
     @staticmethod
     async def init_db():
-        async with aiosqlite.connect(DATABASE_URL) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS rooms (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    token TEXT NOT NULL UNIQUE,
-                    created_at TIMESTAMP NOT NULL,
-                    active_users TEXT DEFAULT '[]'
-                )
-            """)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    text TEXT NOT NULL,
-                    completed BOOLEAN NOT NULL DEFAULT 0,
-                    creator TEXT NOT NULL,
-                    room_id TEXT NOT NULL,
-                    priority TEXT DEFAULT 'medium',
-                    due_date TIMESTAMP,
-                    tags TEXT DEFAULT '[]',
-                    description TEXT,
-                    is_deleted BOOLEAN NOT NULL DEFAULT 0,
-                    created_at TIMESTAMP NOT NULL,
-                    updated_at TIMESTAMP,
-                    deleted_at TIMESTAMP
-                )
-            """)
+        # 结构迁移使用同步sqlite3连接，放到线程里执行，完成后再打开连接池
+        for shard in shards:
+            await asyncio.to_thread(migrate, shard.path, shard_id_base(shard.index))
+            await shard.pool.open()
+            if DB_GROUP_COMMIT:
+                await shard.write_queue.start()
+
+    @staticmethod
+    async def close_db():
+        for shard in shards:
+            await shard.write_queue.stop()
+            await shard.pool.close()
+
+    @staticmethod
+    async def _write(shard: Shard, op: WriteOp):
+        """在分片上执行一个写操作：开启组提交时交给写队列，否则单独提交"""
+        if shard.write_queue.is_running:
+            return await shard.write_queue.submit(op)
+        async with shard.pool.writer() as db:
+            # 显式开始写事务：sqlite3的隐式事务要到第一条写语句才开始，
+            # 之前读到的序号等数据可能已被其他进程的写连接改掉
+            await db.execute("BEGIN IMMEDIATE")
+            result = await op(db)
             await db.commit()
+            return result
+
+    @staticmethod
+    async def _write_returning(task_id: int, query: str, params) -> Optional[TaskRecord]:
+        """在任务所在的分片上执行带RETURNING的单条写语句，返回受影响的任务"""
+        shard = task_shard(task_id)
+        if shard is None:
+            return None
+
+        async def op(db):
+            cursor = await db.execute(query, params)
+            # 必须在提交前取完RETURNING的结果
+            row = await cursor.fetchone()
+            await cursor.close()
+            if not row:
+                return None
+            task = _task_from_row(row)
+            task.seq = await _room_seq(db, task.room_id)
+            return task
+        return await Database._write(shard, op)
 
     @staticmethod
     async def get_room(token: str) -> Optional[Room]:
-        async with aiosqlite.connect(DATABASE_URL) as db:
-            db.row_factory = aiosqlite.Row
+        async with room_shard(token).pool.reader() as db:
             cursor = await db.execute(
                 "SELECT * FROM rooms WHERE token = ?", (token,)
             )
             row = await cursor.fetchone()
             if row:
+                # 在线用户由ConnectionManager在内存中维护，这里不读数据库
                 return Room(
                     id=row['id'],
                     token=row['token'],
                     created_at=datetime.fromisoformat(row['created_at']),
-                    active_users=eval(row['active_users'])
+                    active_users=[]
                 )
             return None
 
     @staticmethod
     async def create_room(token: str) -> Room:
-        async with aiosqlite.connect(DATABASE_URL) as db:
-            created_at = datetime.utcnow()
+        created_at = datetime.utcnow()
+
+        async def op(db):
             cursor = await db.execute(
                 "INSERT INTO rooms (token, created_at) VALUES (?, ?)",
                 (token, created_at.isoformat())
             )
-            await db.commit()
             return Room(
                 id=cursor.lastrowid,
                 token=token,
                 created_at=created_at,
                 active_users=[]
             )
+        # 房间按token一致性哈希到分片，之后该房间的所有数据都在这个分片
+        return await Database._write(room_shard(token), op)
+
+    @staticmethod
+    async def save_presence(worker: str, snapshot: Dict[str, List[str]], stale_before: float):
+        """用本进程的在线用户快照替换该worker之前的记录，并清理已失效worker的记录
+
+        每个房间的在线状态写在房间所在的分片，没有在线房间的分片也要清掉该worker的旧记录。
+        """
+        now = time.time()
+        rows: Dict[int, list] = {shard.index: [] for shard in shards}
+        for room_id, users in snapshot.items():
+            if users:
+                rows[room_shard(room_id).index].append(
+                    (room_id, worker, json.dumps(users, ensure_ascii=False), now)
+                )
+
+        for shard in shards:
+            async def op(db, values=rows[shard.index]):
+                await db.execute("DELETE FROM room_presence WHERE worker = ? OR updated_at < ?", (worker, stale_before))
+                await db.executemany(
+                    "INSERT INTO room_presence (room_id, worker, users, updated_at) VALUES (?, ?, ?, ?)", values
+                )
+            await Database._write(shard, op)
+
+    @staticmethod
+    async def clear_presence(worker: str):
+        async def op(db):
+            await db.execute("DELETE FROM room_presence WHERE worker = ?", (worker,))
+        for shard in shards:
+            await Database._write(shard, op)
+
+    @staticmethod
+    async def get_presence(room_id: str, exclude_worker: str, fresh_after: float) -> Set[str]:
+        """其他worker快照中房间的在线用户"""
+        async with room_shard(room_id).pool.reader() as db:
+            rows = await db.execute_fetchall(
+                "SELECT users FROM room_presence WHERE room_id = ? AND worker != ? AND updated_at >= ?",
+                (room_id, exclude_worker, fresh_after)
+            )
+        users = set()
+        for row in rows:
+            users.update(json.loads(row['users']))
+        return users
 
     @staticmethod
-    async def update_room_users(room_id: int, active_users: List[str]):
-        async with aiosqlite.connect(DATABASE_URL) as db:
+    async def get_tasks(
+        room_id: str,
+        include_deleted: bool = False,
+        *,
+        completed: Optional[bool] = None,
+        priorities: Optional[List[Priority]] = None,
+        creator: Optional[str] = None,
+        due_after: Optional[datetime] = None,
+        due_before: Optional[datetime] = None,
+        sort: TaskSort = TaskSort.CREATED_AT,
+        order: Optional[SortOrder] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> List[TaskRecord]:
+        """房间任务列表，支持筛选、排序和基于游标（keyset）的分页
+
+        cursor 是上一页最后一个任务的 encode_task_cursor(task, sort)，排序参数必须与上一页相同。
+        """
+        sort_sql, default_order = _SORT_SQL[sort]
+        descending = (order or default_order) == SortOrder.DESC
+        where = ["room_id = ?"]
+        params: list = [room_id]
+        if not include_deleted:
+            where.append("is_deleted = 0")
+        if completed is not None:
+            where.append("completed = ?")
+            params.append(completed)
+        if priorities:
+            where.append(f"priority IN ({', '.join('?' * len(priorities))})")
+            params.extend(p.value for p in priorities)
+        if creator is not None:
+            where.append("creator = ?")
+            params.append(creator)
+        if due_after is not None:
+            where.append("due_date >= ?")
+            params.append(due_after.isoformat())
+        if due_before is not None:
+            where.append("due_date < ?")
+            params.append(due_before.isoformat())
+        if cursor:
+            value, last_id = _decode_task_cursor(cursor)
+            where.append(_keyset_condition(sort_sql, descending))
+            params.extend((value, value, last_id))
+
+        direction = "DESC" if descending else "ASC"
+        query = f"SELECT * FROM tasks WHERE {' AND '.join(where)} ORDER BY {sort_sql} {direction}, id {direction}"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        async with room_shard(room_id).pool.reader() as db:
+            rows = await db.execute_fetchall(query, params)
+            return [_task_from_row(row) for row in rows]
+    
+    @staticmethod
+    async def iter_tasks(
+        room_id: str, include_deleted: bool = False, chunk_size: int = 500
+    ) -> AsyncIterator[List[TaskRecord]]:
+        """按创建时间分块读取房间任务，用于流式导出
+
+        每块单独借用一次读连接并按 (created_at, id) 翻页，导出大房间时内存占用和占用连接的时间
+        都与房间大小无关；不同块之间不是同一个快照。
+        """
+        shard = room_shard(room_id)
+        for is_deleted in ((0, 1) if include_deleted else (0,)):
+            last = ("", 0)
+            while True:
+                async with shard.pool.reader() as db:
+                    rows = await db.execute_fetchall(
+                        """SELECT * FROM tasks WHERE room_id = ? AND is_deleted = ? AND (created_at, id) > (?, ?)
+                           ORDER BY created_at, id LIMIT ?""",
+                        (room_id, is_deleted, *last, chunk_size)
+                    )
+                if not rows:
+                    break
+                yield [_task_from_row(row) for row in rows]
+                if len(rows) < chunk_size:
+                    break
+                last = (rows[-1]['created_at'], rows[-1]['id'])
+
+    @staticmethod
+    async def import_tasks(room_id: str, items: List[TaskImport]) -> Tuple[List[TaskRecord], Tuple[int, int]]:
+        """在一个事务中用executemany把一批任务导入房间
+
+        返回新建的任务，以及导入前后房间的事件序号 (prev_seq, seq)。
+        """
+        now = datetime.utcnow().isoformat()
+
+        def iso(value: Optional[datetime]) -> Optional[str]:
+            return value.isoformat() if value else None
+
+        values = [
+            (item.text, item.completed, item.creator, room_id, item.priority.value, iso(item.due_date),
+             _encode_tags(item.tags), item.description, item.is_deleted,
+             iso(item.created_at) or now, iso(item.updated_at), iso(item.deleted_at))
+            for item in items
+        ]
+
+        async def op(db):
+            prev_seq = await _room_seq(db, room_id)
+            await db.executemany(
+                """INSERT INTO tasks (text, completed, creator, room_id, priority, due_date, tags, description,
+                                      is_deleted, created_at, updated_at, deleted_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                values
+            )
+            # 持有写锁的同一事务内，AUTOINCREMENT分配的id是连续的
+            cursor = await db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'tasks'")
+            first_id = (await cursor.fetchone())['seq'] - len(values) + 1
+            tasks = [
+                TaskRecord(first_id + offset, *row[:6], list(item.tags), *row[7:])
+                for offset, (row, item) in enumerate(zip(values, items))
+            ]
+            return tasks, (prev_seq, await _room_seq(db, room_id))
+
+        if not values:
+            return [], (0, 0)
+        return await Database._write(room_shard(room_id), op)
+
+    @staticmethod
+    async def save_import_job(job: Dict[str, Any], keep: int):
+        """保存导入进度，只保留最近的keep个导入任务
+
+        导入进度和房间无关，查询时只有job_id，所以统一写在分片0。
+        """
+        def iso(value: Optional[datetime]) -> Optional[str]:
+            return value.isoformat() if value else None
+
+        values = (
+            job["job_id"], job["room_id"], job["format"], job["status"], job["rows"], job["imported"],
+            job["failed"], job["batches"], json.dumps(job["errors"], ensure_ascii=False),
+            iso(job["started_at"]), iso(job["finished_at"]),
+        )
+
+        async def op(db):
             await db.execute(
-                "UPDATE rooms SET active_users = ? WHERE id = ?",
-                (str(active_users), room_id)
+                """INSERT OR REPLACE INTO import_jobs (job_id, room_id, format, status, rows, imported, failed,
+                                                       batches, errors, started_at, finished_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                values
             )
-            await db.commit()
+            await db.execute(
+                """DELETE FROM import_jobs WHERE job_id NOT IN
+                   (SELECT job_id FROM import_jobs ORDER BY started_at DESC LIMIT ?)""",
+                (keep,)
+            )
+        await Database._write(shards[0], op)
 
     @staticmethod
-    async def get_tasks(room_id: str, include_deleted: bool = False) -> List[Task]:
-        async with aiosqlite.connect(DATABASE_URL) as db:
-            db.row_factory = aiosqlite.Row
-            if include_deleted:
-                query = "SELECT * FROM tasks WHERE room_id = ? ORDER BY created_at DESC"
-            else:
-                query = "SELECT * FROM tasks WHERE room_id = ? AND is_deleted = 0 ORDER BY created_at DESC"
-            cursor = await db.execute(query, (room_id,))
-            rows = await cursor.fetchall()
-            return [
-                Task(
-                    id=row['id'],
-                    text=row['text'],
-                    completed=bool(row['completed']),
-                    creator=row['creator'],
-                    room_id=row['room_id'],
-                    priority=row['priority'] or 'medium',
-                    due_date=datetime.fromisoformat(row['due_date']) if row['due_date'] else None,
-                    tags=eval(row['tags']) if row['tags'] else [],
-                    description=row['description'],
-                    is_deleted=bool(row['is_deleted']),
-                    created_at=datetime.fromisoformat(row['created_at']),
-                    updated_at=datetime.fromisoformat(row['updated_at']) if row['updated_at'] else None,
-                    deleted_at=datetime.fromisoformat(row['deleted_at']) if row['deleted_at'] else None
+    async def get_import_job(job_id: str) -> Optional[Dict[str, Any]]:
+        async with shards[0].pool.reader() as db:
+            cursor = await db.execute("SELECT * FROM import_jobs WHERE job_id = ?", (job_id,))
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job["errors"] = json.loads(job["errors"])
+        return job
+
+    @staticmethod
+    async def get_room_rev(room_id: str) -> int:
+        """房间当前版本号，任何任务变更都会使其增大"""
+        async with room_shard(room_id).pool.reader() as db:
+            cursor = await db.execute("SELECT rev FROM room_revs WHERE room_id = ?", (room_id,))
+            row = await cursor.fetchone()
+            return row['rev'] if row else 0
+
+    @staticmethod
+    async def get_room_seq(room_id: str) -> int:
+        """房间当前的事件序号，WebSocket续传时用来判断客户端落后了多少"""
+        async with room_shard(room_id).pool.reader() as db:
+            return await _room_seq(db, room_id)
+
+    @staticmethod
+    async def get_room_snapshot(room_id: str) -> Tuple[int, List[TaskRecord]]:
+        """在同一个读事务中取房间的事件序号和未删除任务，二者保证一致"""
+        async with room_shard(room_id).pool.reader() as db:
+            await db.execute("BEGIN")
+            try:
+                seq = await _room_seq(db, room_id)
+                rows = await db.execute_fetchall(
+                    "SELECT * FROM tasks WHERE room_id = ? AND is_deleted = 0 ORDER BY created_at DESC",
+                    (room_id,)
                 )
-                for row in rows
-            ]
-    
+            finally:
+                await db.execute("COMMIT")
+            return seq, [_task_from_row(row) for row in rows]
+
     @staticmethod
-    async def get_task_by_id(task_id: int) -> Optional[Task]:
-        """根据ID获取单个任务"""
-        async with aiosqlite.connect(DATABASE_URL) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
+    async def get_task_changes(room_id: str, since: Optional[int] = None) -> TaskChanges:
+        """返回版本号since之后房间内发生变化的任务
+
+        未提供since、since早于已清理的墓碑记录或大于当前版本时返回全量快照（reset=True）。
+        """
+        async with room_shard(room_id).pool.reader() as db:
+            cursor = await db.execute("SELECT rev, tombstone_floor FROM sync_state WHERE id = 1")
+            state = await cursor.fetchone()
+            cursor = await db.execute("SELECT rev FROM room_revs WHERE room_id = ?", (room_id,))
             row = await cursor.fetchone()
-            if row:
-                return Task(
-                    id=row['id'],
-                    text=row['text'],
-                    completed=bool(row['completed']),
-                    creator=row['creator'],
-                    room_id=row['room_id'],
-                    priority=row['priority'] or 'medium',
-                    due_date=datetime.fromisoformat(row['due_date']) if row['due_date'] else None,
-                    tags=eval(row['tags']) if row['tags'] else [],
-                    description=row['description'],
-                    is_deleted=bool(row['is_deleted']),
-                    created_at=datetime.fromisoformat(row['created_at']),
-                    updated_at=datetime.fromisoformat(row['updated_at']) if row['updated_at'] else None,
-                    deleted_at=datetime.fromisoformat(row['deleted_at']) if row['deleted_at'] else None
+            room_rev = row['rev'] if row else 0
+
+            if since is None or since < state['tombstone_floor'] or since > state['rev']:
+                cursor = await db.execute(
+                    "SELECT * FROM tasks WHERE room_id = ? AND is_deleted = 0 ORDER BY created_at DESC",
+                    (room_id,)
+                )
+                rows = await cursor.fetchall()
+                return construct(
+                    TaskChanges,
+                    cursor=state['rev'],
+                    reset=True,
+                    tasks=[_task_from_row(row) for row in rows],
+                    deleted=[]
                 )
+
+            # 房间没有变化时只需要一次主键查询
+            if room_rev <= since:
+                return construct(TaskChanges, cursor=since, reset=False, tasks=[], deleted=[])
+
+            cursor = await db.execute(
+                "SELECT * FROM tasks WHERE room_id = ? AND rev > ? ORDER BY rev",
+                (room_id, since)
+            )
+            rows = await cursor.fetchall()
+            tasks = []
+            deleted = []
+            for row in rows:
+                if row['is_deleted']:
+                    deleted.append(row['id'])
+                else:
+                    tasks.append(_task_from_row(row))
+            cursor = await db.execute(
+                "SELECT task_id FROM task_tombstones WHERE room_id = ? AND rev > ?",
+                (room_id, since)
+            )
+            deleted.extend(row['task_id'] for row in await cursor.fetchall())
+            return construct(TaskChanges, cursor=room_rev, reset=False, tasks=tasks, deleted=deleted)
+
+    @staticmethod
+    async def get_task_by_id(task_id: int) -> Optional[TaskRecord]:
+        """根据ID获取单个任务"""
+        shard = task_shard(task_id)
+        if shard is None:
             return None
+        async with shard.pool.reader() as db:
+            cursor = await db.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
+            row = await cursor.fetchone()
+            return _task_from_row(row) if row else None
 
     @staticmethod
     async def create_task(text: str, creator: str, room_id: str, priority: str = 'medium', 
                          due_date: Optional[datetime] = None, tags: List[str] = None, 
-                         description: Optional[str] = None) -> Task:
-        async with aiosqlite.connect(DATABASE_URL) as db:
-            created_at = datetime.utcnow()
-            tags_str = str(tags or [])
+                         description: Optional[str] = None) -> TaskRecord:
+        created_at = datetime.utcnow()
+        tags_str = _encode_tags(tags)
+
+        async def op(db):
             cursor = await db.execute(
                 """INSERT INTO tasks (text, creator, room_id, priority, due_date, tags, description, created_at) 
                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
@@ -146,121 +651,358 @@ class Database:
                  due_date.isoformat() if due_date else None, 
                  tags_str, description, created_at.isoformat())
             )
-            await db.commit()
-            return Task(
-                id=cursor.lastrowid,
-                text=text,
-                completed=False,
-                creator=creator,
-                room_id=room_id,
-                priority=priority,
-                due_date=due_date,
-                tags=tags or [],
-                description=description,
-                is_deleted=False,
-                created_at=created_at
+            return TaskRecord(
+                cursor.lastrowid, text, False, creator, room_id,
+                getattr(priority, 'value', priority),
+                due_date.isoformat() if due_date else None,
+                list(tags or []), description, False, created_at.isoformat(), None, None,
+                seq=await _room_seq(db, room_id)
             )
+        return await Database._write(room_shard(room_id), op)
 
     @staticmethod
-    async def update_task(task_id: int, **kwargs) -> Optional[Task]:
-        async with aiosqlite.connect(DATABASE_URL) as db:
-            db.row_factory = aiosqlite.Row
-            
-            # 构建动态更新语句
-            update_fields = []
-            update_values = []
-            
-            for field, value in kwargs.items():
-                if field == 'tags' and value is not None:
-                    update_fields.append(f"{field} = ?")
-                    update_values.append(str(value))
-                elif field == 'due_date' and value is not None:
-                    update_fields.append(f"{field} = ?")
-                    update_values.append(value.isoformat() if isinstance(value, datetime) else value)
-                elif value is not None:
-                    update_fields.append(f"{field} = ?")
-                    update_values.append(value)
-            
-            if update_fields:
-                # 添加更新时间
-                update_fields.append("updated_at = ?")
-                update_values.append(datetime.utcnow().isoformat())
-                
-                update_values.append(task_id)
-                query = f"UPDATE tasks SET {', '.join(update_fields)} WHERE id = ?"
-                await db.execute(query, update_values)
-                await db.commit()
-            
-            cursor = await db.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
-            row = await cursor.fetchone()
-            if row:
-                return Task(
-                    id=row['id'],
-                    text=row['text'],
-                    completed=bool(row['completed']),
-                    creator=row['creator'],
-                    room_id=row['room_id'],
-                    priority=row['priority'] or 'medium',
-                    due_date=datetime.fromisoformat(row['due_date']) if row['due_date'] else None,
-                    tags=eval(row['tags']) if row['tags'] else [],
-                    description=row['description'],
-                    is_deleted=bool(row['is_deleted']),
-                    created_at=datetime.fromisoformat(row['created_at']),
-                    updated_at=datetime.fromisoformat(row['updated_at']) if row['updated_at'] else None,
-                    deleted_at=datetime.fromisoformat(row['deleted_at']) if row['deleted_at'] else None
-                )
-            return None
+    async def update_task(task_id: int, **kwargs) -> Optional[TaskRecord]:
+        # 构建动态更新语句
+        update_fields = []
+        update_values = []
+        
+        for field, value in kwargs.items():
+            if field == 'tags' and value is not None:
+                update_fields.append(f"{field} = ?")
+                update_values.append(_encode_tags(value))
+            elif field == 'due_date' and value is not None:
+                update_fields.append(f"{field} = ?")
+                update_values.append(value.isoformat() if isinstance(value, datetime) else value)
+            elif value is not None:
+                update_fields.append(f"{field} = ?")
+                update_values.append(value)
+        
+        if not update_fields:
+            return await Database.get_task_by_id(task_id)
+
+        # 添加更新时间
+        update_fields.append("updated_at = ?")
+        update_values.append(datetime.utcnow().isoformat())
+
+        update_values.append(task_id)
+        query = f"UPDATE tasks SET {', '.join(update_fields)} WHERE id = ? RETURNING *"
+        return await Database._write_returning(task_id, query, update_values)
+
+    @staticmethod
+    async def toggle_task(task_id: int) -> Optional[TaskRecord]:
+        """原子地切换任务完成状态，避免先读后写的并发覆盖"""
+        return await Database._write_returning(
+            task_id, "UPDATE tasks SET completed = NOT completed, updated_at = ? WHERE id = ? RETURNING *",
+            (datetime.utcnow().isoformat(), task_id)
+        )
 
     @staticmethod
-    async def delete_task(task_id: int, soft_delete: bool = True):
-        async with aiosqlite.connect(DATABASE_URL) as db:
-            if soft_delete:
-                # 软删除：标记为已删除
-                deleted_at = datetime.utcnow()
+    async def delete_task(task_id: int, soft_delete: bool = True) -> Optional[TaskRecord]:
+        """删除任务，返回被删除的任务；任务不存在时返回None"""
+        if soft_delete:
+            # 软删除：标记为已删除
+            return await Database._write_returning(
+                task_id, "UPDATE tasks SET is_deleted = 1, deleted_at = ? WHERE id = ? RETURNING *",
+                (datetime.utcnow().isoformat(), task_id)
+            )
+        # 硬删除：永久删除
+        return await Database._write_returning(
+            task_id, "DELETE FROM tasks WHERE id = ? RETURNING *", (task_id,)
+        )
+
+    @staticmethod
+    async def restore_task(task_id: int) -> Optional[TaskRecord]:
+        """恢复已删除的任务，返回恢复后的任务"""
+        return await Database._write_returning(
+            task_id, "UPDATE tasks SET is_deleted = 0, deleted_at = NULL WHERE id = ? RETURNING *",
+            (task_id,)
+        )
+
+    @staticmethod
+    async def apply_task_batch(
+        room_id: str, operations: List[TaskBatchOperation]
+    ) -> Tuple[List[TaskBatchResult], Tuple[int, int]]:
+        """在一个事务中执行一组任务操作
+
+        连续的同类操作合并为一次executemany，顺序与请求一致；只能操作本房间的任务。
+        返回每一项的结果（其中的任务是整个批次执行完之后的状态），
+        以及批次前后房间的事件序号 (prev_seq, seq)。
+        """
+        now = datetime.utcnow().isoformat()
+
+        async def op(db):
+            prev_seq = await _room_seq(db, room_id)
+            results: List[Optional[TaskBatchResult]] = [None] * len(operations)
+            existing = await _existing_task_ids(
+                db, room_id, {item.task_id for item in operations if item.task_id is not None}
+            )
+            touched = set()
+
+            def run_key(pair):
+                item = pair[1]
+                return item.op, item.op == BatchOperationType.DELETE and item.permanent
+
+            for (kind, permanent), run in groupby(enumerate(operations), key=run_key):
+                accepted = []
+                for index, item in run:
+                    if kind == BatchOperationType.CREATE:
+                        if not item.text or not item.creator:
+                            results[index] = TaskBatchResult(
+                                index=index, status="invalid", error="create需要text和creator"
+                            )
+                            continue
+                    elif item.task_id is None:
+                        results[index] = TaskBatchResult(index=index, status="invalid", error="缺少task_id")
+                        continue
+                    elif item.task_id not in existing:
+                        results[index] = TaskBatchResult(index=index, status="not_found", task_id=item.task_id)
+                        continue
+                    accepted.append((index, item))
+                if not accepted:
+                    continue
+
+                if kind == BatchOperationType.CREATE:
+                    await db.executemany(
+                        """INSERT INTO tasks (text, completed, creator, room_id, priority, due_date, tags, description, created_at)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        [
+                            (item.text, bool(item.completed), item.creator, room_id, item.priority or 'medium',
+                             item.due_date.isoformat() if item.due_date else None,
+                             _encode_tags(item.tags), item.description, now)
+                            for _, item in accepted
+                        ]
+                    )
+                    # 持有写锁的同一事务内，AUTOINCREMENT分配的id是连续的
+                    cursor = await db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'tasks'")
+                    last_id = (await cursor.fetchone())['seq']
+                    first_id = last_id - len(accepted) + 1
+                    for offset, (index, _) in enumerate(accepted):
+                        task_id = first_id + offset
+                        existing.add(task_id)
+                        results[index] = TaskBatchResult(index=index, status="ok", task_id=task_id)
+                    touched.update(range(first_id, last_id + 1))
+                    continue
+
+                if kind == BatchOperationType.UPDATE:
+                    await db.executemany(
+                        """UPDATE tasks SET text = COALESCE(?, text), completed = COALESCE(?, completed),
+                               priority = COALESCE(?, priority), due_date = COALESCE(?, due_date),
+                               tags = COALESCE(?, tags), description = COALESCE(?, description),
+                               updated_at = ?
+                           WHERE id = ? AND room_id = ?""",
+                        [
+                            (item.text, item.completed, item.priority,
+                             item.due_date.isoformat() if item.due_date else None,
+                             _encode_tags(item.tags) if item.tags is not None else None,
+                             item.description, now, item.task_id, room_id)
+                            for _, item in accepted
+                        ]
+                    )
+                elif kind == BatchOperationType.DELETE and permanent:
+                    await db.executemany(
+                        "DELETE FROM tasks WHERE id = ? AND room_id = ?",
+                        [(item.task_id, room_id) for _, item in accepted]
+                    )
+                    existing.difference_update(item.task_id for _, item in accepted)
+                elif kind == BatchOperationType.DELETE:
+                    await db.executemany(
+                        "UPDATE tasks SET is_deleted = 1, deleted_at = ? WHERE id = ? AND room_id = ?",
+                        [(now, item.task_id, room_id) for _, item in accepted]
+                    )
+                else:
+                    await db.executemany(
+                        "UPDATE tasks SET is_deleted = 0, deleted_at = NULL WHERE id = ? AND room_id = ?",
+                        [(item.task_id, room_id) for _, item in accepted]
+                    )
+                for index, item in accepted:
+                    results[index] = TaskBatchResult(index=index, status="ok", task_id=item.task_id)
+                    touched.add(item.task_id)
+
+            # 取回受影响任务的最终状态
+            final = {}
+            for chunk in _chunks(sorted(touched)):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = await db.execute(f"SELECT * FROM tasks WHERE id IN ({placeholders})", chunk)
+                for row in await cursor.fetchall():
+                    final[row['id']] = _task_from_row(row)
+            for result in results:
+                if result.status == "ok":
+                    result.task = final.get(result.task_id)
+            return results, (prev_seq, await _room_seq(db, room_id))
+
+        return await Database._write(room_shard(room_id), op)
+
+    @staticmethod
+    async def purge_trash(
+        deleted_before: datetime, limit: int, shard: int = 0
+    ) -> Dict[str, Tuple[List[int], Tuple[int, int]]]:
+        """永久删除分片回收站中删除时间早于deleted_before的任务，每次最多limit条
+
+        返回每个房间被删除的任务id和事件序号 (prev_seq, seq)。
+        """
+        async def op(db):
+            rows = await db.execute_fetchall(
+                "SELECT id, room_id FROM tasks WHERE is_deleted = 1 AND deleted_at < ? ORDER BY deleted_at LIMIT ?",
+                (deleted_before.isoformat(), limit)
+            )
+            return await _remove_tasks(db, rows)
+        return await Database._write(shards[shard], op)
+
+    @staticmethod
+    async def archive_completed(
+        completed_before: datetime, limit: int, shard: int = 0
+    ) -> Dict[str, Tuple[List[int], Tuple[int, int]]]:
+        """把分片中最后更新时间早于completed_before的已完成任务移到tasks_archive，每次最多limit条"""
+        columns = ", ".join(TASK_FIELDS)
+
+        async def op(db):
+            rows = await db.execute_fetchall(
+                f"""SELECT id, room_id FROM tasks
+                    WHERE completed = 1 AND is_deleted = 0 AND {UPDATED_SORT_SQL} < ?
+                    ORDER BY {UPDATED_SORT_SQL} LIMIT ?""",
+                (completed_before.isoformat(), limit)
+            )
+            now = datetime.utcnow().isoformat()
+            for chunk in _chunks([row['id'] for row in rows]):
                 await db.execute(
-                    "UPDATE tasks SET is_deleted = 1, deleted_at = ? WHERE id = ?",
-                    (deleted_at.isoformat(), task_id)
+                    f"""INSERT OR REPLACE INTO tasks_archive ({columns}, archived_at)
+                        SELECT {columns}, ? FROM tasks WHERE id IN ({', '.join('?' * len(chunk))})""",
+                    [now, *chunk]
                 )
-            else:
-                # 硬删除：永久删除
-                await db.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
-            await db.commit()
-    
+            return await _remove_tasks(db, rows)
+        return await Database._write(shards[shard], op)
+
     @staticmethod
-    async def restore_task(task_id: int):
-        """恢复已删除的任务"""
-        async with aiosqlite.connect(DATABASE_URL) as db:
+    async def prune_tombstones(keep_revs: int, limit: int, shard: int = 0) -> int:
+        """删除分片中早于最近keep_revs个版本的墓碑记录，并相应提高tombstone_floor
+
+        since低于tombstone_floor的增量同步请求会收到全量快照，所以不会漏掉删除。
+        """
+        async def op(db):
+            cursor = await db.execute("SELECT rev FROM sync_state WHERE id = 1")
+            floor = (await cursor.fetchone())['rev'] - keep_revs
+            if floor <= 0:
+                return 0
             await db.execute(
-                "UPDATE tasks SET is_deleted = 0, deleted_at = NULL WHERE id = ?",
-                (task_id,)
+                "UPDATE sync_state SET tombstone_floor = MAX(tombstone_floor, ?) WHERE id = 1", (floor,)
+            )
+            cursor = await db.execute(
+                """DELETE FROM task_tombstones WHERE task_id IN
+                   (SELECT task_id FROM task_tombstones WHERE rev < ? LIMIT ?)""",
+                (floor, limit)
             )
+            return cursor.rowcount
+        return await Database._write(shards[shard], op)
+
+    @staticmethod
+    async def vacuum(pages: int, shard: int = 0) -> Dict[str, int]:
+        """归还分片最多pages个空闲页（仅增量vacuum模式），并让SQLite按需更新统计信息"""
+        async with shards[shard].pool.writer() as db:
+            auto_vacuum = (await db.execute_fetchall("PRAGMA auto_vacuum"))[0][0]
+            before = (await db.execute_fetchall("PRAGMA freelist_count"))[0][0]
+            # 2 = INCREMENTAL
+            if auto_vacuum == 2 and before:
+                await db.execute_fetchall(f"PRAGMA incremental_vacuum({int(pages)})")
+            await db.execute_fetchall("PRAGMA optimize")
+            after = (await db.execute_fetchall("PRAGMA freelist_count"))[0][0]
+            page_count = (await db.execute_fetchall("PRAGMA page_count"))[0][0]
+            page_size = (await db.execute_fetchall("PRAGMA page_size"))[0][0]
             await db.commit()
-    
+        return {
+            "auto_vacuum": auto_vacuum,
+            "freed_pages": before - after,
+            "freelist_pages": after,
+            "size_bytes": page_count * page_size,
+        }
+
     @staticmethod
-    async def get_deleted_tasks(room_id: str) -> List[Task]:
+    async def get_tasks_by_tag(room_id: str, tag: str) -> List[TaskRecord]:
+        """房间内带有指定标签的未删除任务"""
+        async with room_shard(room_id).pool.reader() as db:
+            cursor = await db.execute(
+                """SELECT tasks.* FROM task_tags
+                   JOIN tasks ON tasks.id = task_tags.task_id
+                   WHERE task_tags.room_id = ? AND task_tags.tag = ? AND tasks.is_deleted = 0
+                   ORDER BY tasks.created_at DESC""",
+                (room_id, tag)
+            )
+            rows = await cursor.fetchall()
+            return [_task_from_row(row) for row in rows]
+
+    @staticmethod
+    async def get_tag_counts(room_id: str) -> List[TagCount]:
+        """房间内每个标签的未删除任务数"""
+        async with room_shard(room_id).pool.reader() as db:
+            cursor = await db.execute(
+                """SELECT task_tags.tag AS tag, COUNT(*) AS count FROM task_tags
+                   JOIN tasks ON tasks.id = task_tags.task_id
+                   WHERE task_tags.room_id = ? AND tasks.is_deleted = 0
+                   GROUP BY task_tags.tag
+                   ORDER BY count DESC, tag""",
+                (room_id,)
+            )
+            return [TagCount(tag=row['tag'], count=row['count']) for row in await cursor.fetchall()]
+
+    @staticmethod
+    async def search_tasks(room_id: str, q: str, limit: int = 20, offset: int = 0) -> TaskSearchResults:
+        """在房间未删除的任务中搜索标题和描述，按相关度排序
+
+        所有词都至少3个字符时走FTS5索引（bm25排序并返回高亮片段）；
+        否则退化为在房间内逐条LIKE匹配，按创建时间倒序。
+        """
+        terms = _search_terms(q)
+        if not terms:
+            return TaskSearchResults()
+        pre, post = SEARCH_HIGHLIGHT
+        if all(len(term) >= _SEARCH_MIN_TERM for term in terms):
+            query = f"""SELECT tasks.*,
+                       snippet(tasks_fts, 0, ?, ?, '…', {SEARCH_SNIPPET_TOKENS}) AS text_snippet,
+                       snippet(tasks_fts, 1, ?, ?, '…', {SEARCH_SNIPPET_TOKENS}) AS description_snippet
+                   FROM tasks_fts JOIN tasks ON tasks.id = tasks_fts.rowid
+                   WHERE tasks_fts MATCH ? AND tasks.room_id = ? AND tasks.is_deleted = 0
+                   ORDER BY tasks_fts.rank
+                   LIMIT ? OFFSET ?"""
+            params = [pre, post, pre, post, _fts_query(terms), room_id, limit + 1, offset]
+        else:
+            where = " AND ".join(
+                "(text LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\')" for _ in terms
+            )
+            query = f"""SELECT *, text AS text_snippet, description AS description_snippet FROM tasks
+                   WHERE room_id = ? AND is_deleted = 0 AND {where}
+                   ORDER BY created_at DESC
+                   LIMIT ? OFFSET ?"""
+            params = [room_id]
+            for term in terms:
+                params.extend((_like_pattern(term), _like_pattern(term)))
+            params.extend((limit + 1, offset))
+        async with room_shard(room_id).pool.reader() as db:
+            rows = await db.execute_fetchall(query, params)
+        hits = [
+            construct(
+                TaskSearchHit,
+                task=_task_from_row(row),
+                text_snippet=row['text_snippet'] or row['text'],
+                description_snippet=row['description_snippet'] or None,
+            )
+            for row in rows[:limit]
+        ]
+        return construct(
+            TaskSearchResults,
+            results=hits,
+            next_offset=offset + limit if len(rows) > limit else None,
+        )
+
+    @staticmethod
+    async def get_deleted_tasks(room_id: str) -> List[TaskRecord]:
         """获取垃圾桶中的任务"""
-        async with aiosqlite.connect(DATABASE_URL) as db:
-            db.row_factory = aiosqlite.Row
+        async with room_shard(room_id).pool.reader() as db:
             cursor = await db.execute(
                 "SELECT * FROM tasks WHERE room_id = ? AND is_deleted = 1 ORDER BY deleted_at DESC",
                 (room_id,)
             )
             rows = await cursor.fetchall()
-            return [
-                Task(
-                    id=row['id'],
-                    text=row['text'],
-                    completed=bool(row['completed']),
-                    creator=row['creator'],
-                    room_id=row['room_id'],
-                    priority=row['priority'] or 'medium',
-                    due_date=datetime.fromisoformat(row['due_date']) if row['due_date'] else None,
-                    tags=eval(row['tags']) if row['tags'] else [],
-                    description=row['description'],
-                    is_deleted=bool(row['is_deleted']),
-                    created_at=datetime.fromisoformat(row['created_at']),
-                    updated_at=datetime.fromisoformat(row['updated_at']) if row['updated_at'] else None,
-                    deleted_at=datetime.fromisoformat(row['deleted_at']) if row['deleted_at'] else None
-                )
-                for row in rows
-            ]
\ No newline at end of file
+            return [_task_from_row(row) for row in rows]
+
+
+# 每个公开方法的耗时、行数和慢查询日志，见 metrics.py
+metrics.instrument_queries(Database)
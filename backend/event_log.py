@@ -0,0 +1,111 @@
+"""
+房间事件日志
+
+每个任务事件带有房间事件序号：seq 是事件之后房间的序号，prev_seq 是事件之前的序号
+（单个任务的变更 prev_seq = seq - 1，批量操作跨越多个序号）。
+每个进程在内存中为最近活跃的房间各保留最近的若干条已编码事件，
+客户端断线重连时带上 last_seq，只要从 last_seq 到当前序号的事件链完整，
+就只补发缺失的事件；否则由调用方退回到全量快照。
+
+批量操作和导入的事件可能很大，除了事件数之外每个房间和整个日志还有字节预算，
+超出时先丢弃房间内最旧的事件，再丢弃最久没有事件的房间；被丢弃的部分只会让续传退回快照。
+"""
+
+import os
+import bisect
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# 每个房间保留的事件数
+ROOM_EVENT_LOG_SIZE = int(os.getenv("ROOM_EVENT_LOG_SIZE", "256"))
+# 最多为多少个房间保留事件，超出时丢弃最久没有事件的房间
+ROOM_EVENT_LOG_ROOMS = int(os.getenv("ROOM_EVENT_LOG_ROOMS", "1024"))
+# 每个房间和整个事件日志的内存预算（字节，按编码后的消息长度估算）
+ROOM_EVENT_LOG_ROOM_BYTES = int(os.getenv("ROOM_EVENT_LOG_ROOM_BYTES", str(1024 * 1024)))
+ROOM_EVENT_LOG_MAX_BYTES = int(os.getenv("ROOM_EVENT_LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# (seq, prev_seq, frame)
+Event = Tuple[int, int, str]
+
+
+class RoomEventLog:
+    def __init__(
+        self,
+        size: int = ROOM_EVENT_LOG_SIZE,
+        max_rooms: int = ROOM_EVENT_LOG_ROOMS,
+        room_bytes: int = ROOM_EVENT_LOG_ROOM_BYTES,
+        max_bytes: int = ROOM_EVENT_LOG_MAX_BYTES,
+    ):
+        self.size = max(1, size)
+        self.max_rooms = max(1, max_rooms)
+        self.room_bytes = room_bytes
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._rooms: "OrderedDict[str, List[Event]]" = OrderedDict()
+        self._room_bytes: Dict[str, int] = {}
+
+    def append(self, room_id: str, prev_seq: int, seq: int, frame: str):
+        """记录一条事件；来自其他worker的事件可能乱序到达，按seq有序插入"""
+        if len(frame) > min(self.room_bytes, self.max_bytes):
+            # 单条事件就超出预算：不保存，之前的事件也接不上了
+            self._drop_room(room_id)
+            return
+        events = self._rooms.get(room_id)
+        if events is None:
+            events = self._rooms[room_id] = []
+            self._room_bytes[room_id] = 0
+            if len(self._rooms) > self.max_rooms:
+                self._drop_room(next(iter(self._rooms)))
+        else:
+            self._rooms.move_to_end(room_id)
+        if not events or seq > events[-1][0]:
+            events.append((seq, prev_seq, frame))
+        else:
+            index = bisect.bisect_left(events, (seq,))
+            if index < len(events) and events[index][0] == seq:
+                return
+            events.insert(index, (seq, prev_seq, frame))
+        self._room_bytes[room_id] += len(frame)
+        self.bytes += len(frame)
+
+        while len(events) > self.size or self._room_bytes[room_id] > self.room_bytes:
+            self._drop_oldest(room_id)
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._rooms))
+            if oldest == room_id:
+                self._drop_oldest(room_id)
+            else:
+                self._drop_room(oldest)
+
+    def _drop_oldest(self, room_id: str):
+        _, _, frame = self._rooms[room_id].pop(0)
+        self._room_bytes[room_id] -= len(frame)
+        self.bytes -= len(frame)
+
+    def _drop_room(self, room_id: str):
+        if self._rooms.pop(room_id, None) is not None:
+            self.bytes -= self._room_bytes.pop(room_id)
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self._rooms),
+            "events": sum(len(events) for events in self._rooms.values()),
+            "bytes": self.bytes,
+        }
+
+    def replay(self, room_id: str, last_seq: int, current_seq: int) -> Optional[List[str]]:
+        """返回last_seq之后的事件帧；事件链不完整（太旧或有缺口）时返回None"""
+        if last_seq > current_seq:
+            return None
+        if last_seq == current_seq:
+            return []
+        events = self._rooms.get(room_id, [])
+        index = bisect.bisect_right(events, (last_seq, float("inf")))
+        expected = last_seq
+        frames = []
+        for seq, prev_seq, frame in events[index:]:
+            if prev_seq != expected:
+                return None
+            frames.append(frame)
+            expected = seq
+        return frames if expected >= current_seq else None
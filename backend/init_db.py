@@ -1,65 +1,76 @@
 #!/usr/bin/env python3
 """
 数据库初始化脚本
-用于Docker容器启动时初始化数据库
+用于Docker容器启动时初始化数据库，已有数据库会被升级到最新结构
 """
 
-import sqlite3
 import os
+import sys
 from pathlib import Path
 
+from migrations import rebuild_search_index, enable_incremental_vacuum
+from sharding import DATABASE_SHARDS, shard_path, migrate_shards, rebalance
+
+def database_path() -> Path:
+    return Path(os.getenv("DATABASE_URL", str(Path(__file__).parent / "todo.db")).replace("sqlite:///", "", 1))
+
+def shard_paths() -> list:
+    return [shard_path(str(database_path()), index) for index in range(DATABASE_SHARDS)]
+
 def init_database():
-    """初始化SQLite数据库"""
-    db_path = Path(__file__).parent / "todo.db"
-    
-    # 如果数据库已存在，不需要重复初始化
-    if db_path.exists():
-        print(f"数据库已存在: {db_path}")
-        return
-    
-    print(f"正在初始化数据库: {db_path}")
+    """初始化或升级SQLite数据库（分片部署时包括所有分片）"""
+    for path in shard_paths():
+        if Path(path).exists():
+            print(f"数据库已存在，检查结构版本: {path}")
+        else:
+            print(f"正在初始化数据库: {path}")
     
     try:
-        conn = sqlite3.connect(str(db_path))
-        cursor = conn.cursor()
-        
-        # 创建rooms表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS rooms (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                token TEXT NOT NULL UNIQUE,
-                created_at TIMESTAMP NOT NULL,
-                active_users TEXT DEFAULT '[]'
-            )
-        """)
-        
-        # 创建tasks表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                text TEXT NOT NULL,
-                completed BOOLEAN NOT NULL DEFAULT 0,
-                creator TEXT NOT NULL,
-                room_id TEXT NOT NULL,
-                priority TEXT DEFAULT 'medium',
-                due_date TIMESTAMP,
-                tags TEXT DEFAULT '[]',
-                description TEXT,
-                is_deleted BOOLEAN NOT NULL DEFAULT 0,
-                created_at TIMESTAMP NOT NULL,
-                updated_at TIMESTAMP,
-                deleted_at TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
-        conn.close()
-        
-        print("数据库初始化完成")
+        versions = migrate_shards(str(database_path()))
+        print(f"数据库初始化完成，当前结构版本: {max(versions)}")
         
     except Exception as e:
         print(f"数据库初始化失败: {e}")
         raise
 
+def rebuild_search():
+    """重建任务全文索引"""
+    migrate_shards(str(database_path()))
+    for path in shard_paths():
+        print(f"正在重建全文索引: {path}")
+        rebuild_search_index(path)
+    print("全文索引重建完成")
+
+def convert_incremental_vacuum():
+    """已有数据库切换为增量vacuum，之后后台维护才能归还空闲页；需要停机执行"""
+    migrate_shards(str(database_path()))
+    for path in shard_paths():
+        print(f"正在切换为增量vacuum（会重写整个数据库文件）: {path}")
+        enable_incremental_vacuum(path)
+    print("切换完成")
+
+def rebalance_shards(from_count: int):
+    """修改DATABASE_SHARDS后把房间移到新的分片；需要停机执行，中断后可以重新执行"""
+    print(f"正在把房间从 {from_count} 个分片重新分配到 {DATABASE_SHARDS} 个分片")
+    stats = rebalance(str(database_path()), DATABASE_SHARDS, from_count)
+    print(f"重新分配完成：移动了 {stats['rooms']} 个房间、{stats['tasks']} 个任务")
+    if from_count > DATABASE_SHARDS:
+        unused = [shard_path(str(database_path()), index) for index in range(DATABASE_SHARDS, from_count)]
+        print(f"以下分片已清空，可以删除: {', '.join(unused)}")
+
+def option_value(name: str, default: int) -> int:
+    args = sys.argv[1:]
+    return int(args[args.index(name) + 1]) if name in args else default
+
 if __name__ == "__main__":
-    init_database()
\ No newline at end of file
+    # python init_db.py --rebuild-search 重建全文索引
+    # python init_db.py --enable-incremental-vacuum 已有数据库切换为增量vacuum
+    # python init_db.py --rebalance [--from-shards N] 调整分片数后重新分配房间（减少分片时传入原分片数）
+    if "--rebuild-search" in sys.argv[1:]:
+        rebuild_search()
+    elif "--enable-incremental-vacuum" in sys.argv[1:]:
+        convert_incremental_vacuum()
+    elif "--rebalance" in sys.argv[1:]:
+        rebalance_shards(option_value("--from-shards", DATABASE_SHARDS))
+    else:
+        init_database()
@@ -1,14 +1,32 @@
+import time
+import asyncio
 import uvicorn
 import secrets
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request, Response, Query
+from fastapi.responses import StreamingResponse
+from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
-from models import TaskCreate, TaskUpdate, Task, Room, Priority
-from database import Database
-from websocket_manager import ConnectionManager
+from pydantic import ValidationError
+from typing import List, Optional, Tuple
+from models import (
+    TaskCreate, TaskUpdate, Task, Room, Priority, TaskChanges, TaskBatchRequest, TaskBatchResponse,
+    TagCount, TaskSort, SortOrder, TaskSearchResults, TaskCommand, TaskCommandAction, TransferFormat, construct
+)
+from database import Database, encode_task_cursor, shards
+from websocket_manager import ConnectionManager, PRESENCE_SNAPSHOT_INTERVAL, WORKER_ID
+from serialization import FastJSONResponse, encode_json, decode_json
+from cache import RoomCache
+from maintenance import MaintenanceScheduler
+import metrics
+from transfer import (
+    ImportRegistry, ImportFormatError, EXPORT_MEDIA_TYPES, EXPORT_CHUNK_SIZE, IMPORT_BATCH_SIZE,
+    export_disposition, export_tasks, parse_rows, validate_rows
+)
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 manager = ConnectionManager()
+room_cache = RoomCache()
+imports = ImportRegistry()
 
 # CORS设置
 app.add_middleware(
@@ -18,10 +36,46 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 请求耗时统计，按路由模板分组
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+# 在线状态快照超过这么多个写入周期没有更新，就认为对应的worker已经退出
+PRESENCE_STALE_INTERVALS = 3
+presence_task: Optional[asyncio.Task] = None
+
+async def presence_snapshot_loop():
+    """定期把本进程的在线用户写入数据库，供其他worker的 GET /rooms/{token} 合并"""
+    while True:
+        await asyncio.sleep(PRESENCE_SNAPSHOT_INTERVAL)
+        if not manager.presence and not manager.dirty_rooms:
+            continue
+        manager.dirty_rooms.clear()
+        try:
+            await Database.save_presence(
+                WORKER_ID,
+                manager.presence_snapshot(),
+                stale_before=time.time() - PRESENCE_SNAPSHOT_INTERVAL * PRESENCE_STALE_INTERVALS
+            )
+        except Exception as e:
+            print(f"写入在线状态快照失败: {e}")
 
 @app.on_event("startup")
 async def startup_event():
+    global presence_task
     await Database.init_db()
+    await manager.start()
+    if PRESENCE_SNAPSHOT_INTERVAL > 0:
+        presence_task = asyncio.create_task(presence_snapshot_loop())
+    await maintenance.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await maintenance.stop()
+    if presence_task:
+        presence_task.cancel()
+        await Database.clear_presence(WORKER_ID)
+    await manager.stop()
+    await Database.close_db()
 
 # 房间管理接口
 @app.post("/rooms/create", response_model=Room)
@@ -35,31 +89,177 @@ async def get_room(token: str):
     room = await Database.get_room(token)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
+    # 在线用户：本进程的实时状态，加上其他worker最近一次的快照
+    users = manager.get_active_users(token)
+    if PRESENCE_SNAPSHOT_INTERVAL > 0:
+        users |= await Database.get_presence(
+            token, WORKER_ID, fresh_after=time.time() - PRESENCE_SNAPSHOT_INTERVAL * PRESENCE_STALE_INTERVALS
+        )
+    room.active_users = sorted(users)
     return room
 
+async def notify_room(room_id: str, message: dict, seq: Optional[Tuple[int, int]] = None):
+    """任务变更后丢弃房间缓存并广播事件；seq为事件前后房间的事件序号"""
+    room_cache.invalidate(room_id)
+    await manager.broadcast_to_room(room_id=room_id, message=message, seq=seq)
+
+async def notify_tasks_removed(room_id: str, task_ids: List[int], seq: Tuple[int, int]):
+    """后台维护永久删除（清理或归档）任务后通知房间"""
+    await notify_room(room_id, {
+        "type": "tasks_batch",
+        "tasks": [],
+        "deleted": [{"task_id": task_id, "permanent": True} for task_id in task_ids],
+    }, seq)
+
+maintenance = MaintenanceScheduler(notify=notify_tasks_removed)
+
+@app.get("/maintenance/status")
+async def get_maintenance_status():
+    """后台维护状态；多worker部署时只有runner为true的进程在执行维护"""
+    return maintenance.status()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus文本格式的运行指标；每个worker进程单独统计"""
+    body = metrics.render(
+        metrics.worker_families(WORKER_ID),
+        metrics.database_families(shards),
+        metrics.connection_families(manager),
+        metrics.cache_families(room_cache),
+        metrics.maintenance_families(maintenance.status()),
+    )
+    return Response(content=body, media_type=metrics.CONTENT_TYPE)
+
+def task_seq(task) -> Optional[Tuple[int, int]]:
+    """单个任务的写操作使房间事件序号加1"""
+    return (task.seq - 1, task.seq) if task.seq else None
+
+async def cached_task_list(room_id: str, kind: str, request: Request, loader) -> Response:
+    """按房间版本号返回任务列表：未变化时304，缓存命中时直接返回编码好的响应体"""
+    rev = await Database.get_room_rev(room_id)
+    etag = f'"{rev}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    entry = room_cache.get(room_id, kind, rev)
+    if entry is None:
+        entry = room_cache.put(room_id, kind, rev, await loader(room_id))
+    return Response(content=entry.body, media_type="application/json", headers={"ETag": etag})
+
 # 任务管理接口
+# 返回任务的接口直接用FastJSONResponse编码数据库读出的TaskRecord，
+# response_model只用于生成接口文档，不再对可信数据做第二次校验
 @app.get("/rooms/{room_id}/tasks", response_model=List[Task])
-async def get_tasks(room_id: str):
-    return await Database.get_tasks(room_id)
+async def get_tasks(
+    room_id: str,
+    request: Request,
+    completed: Optional[bool] = None,
+    priority: Optional[List[Priority]] = Query(None),
+    creator: Optional[str] = None,
+    due_after: Optional[datetime] = None,
+    due_before: Optional[datetime] = None,
+    sort: TaskSort = TaskSort.CREATED_AT,
+    order: Optional[SortOrder] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+):
+    """房间任务列表
+
+    不带参数时返回完整列表（走缓存和ETag）；带筛选、排序或limit时在数据库中查询，
+    还有下一页时在 X-Next-Cursor 响应头中返回游标。
+    """
+    filtered = any(value is not None for value in (completed, priority, creator, due_after, due_before, order, limit, cursor))
+    if not filtered and sort == TaskSort.CREATED_AT:
+        return await cached_task_list(room_id, "tasks", request, Database.get_tasks)
+    try:
+        tasks = await Database.get_tasks(
+            room_id,
+            completed=completed,
+            priorities=priority,
+            creator=creator,
+            due_after=due_after,
+            due_before=due_before,
+            sort=sort,
+            order=order,
+            limit=limit,
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {}
+    if limit is not None and len(tasks) == limit:
+        headers["X-Next-Cursor"] = encode_task_cursor(tasks[-1], sort)
+    return FastJSONResponse(tasks, headers=headers)
+
+@app.get("/rooms/{room_id}/search", response_model=TaskSearchResults)
+async def search_tasks(
+    room_id: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """搜索房间任务的标题和描述"""
+    return FastJSONResponse(await Database.search_tasks(room_id, q, limit=limit, offset=offset))
+
+@app.get("/rooms/{room_id}/changes", response_model=TaskChanges)
+async def get_task_changes(room_id: str, since: Optional[int] = None):
+    """增量同步：返回cursor之后新增、修改、删除和恢复的任务"""
+    return FastJSONResponse(await Database.get_task_changes(room_id, since))
+
+@app.get("/rooms/{room_id}/tags", response_model=List[TagCount])
+async def get_tag_counts(room_id: str):
+    """房间内的标签及其任务数"""
+    return await Database.get_tag_counts(room_id)
+
+@app.get("/rooms/{room_id}/tags/{tag}/tasks", response_model=List[Task])
+async def get_tasks_by_tag(room_id: str, tag: str):
+    """房间内带有指定标签的任务"""
+    return FastJSONResponse(await Database.get_tasks_by_tag(room_id, tag))
+
+# 任务写操作：HTTP接口和WebSocket命令共用，写入后广播事件
+async def create_task_and_notify(task: TaskCreate):
+    new_task = await Database.create_task(
+        text=task.text,
+        creator=task.creator,
+        room_id=task.room_id,
+        priority=task.priority,
+        due_date=task.due_date,
+        tags=task.tags,
+        description=task.description
+    )
+    await notify_room(task.room_id, {"type": "task_created", "task": new_task}, task_seq(new_task))
+    return new_task
+
+async def update_task_and_notify(task_id: int, task_update: TaskUpdate):
+    # 只传递非None的字段
+    update_data = {k: v for k, v in task_update.dict().items() if v is not None}
+    updated_task = await Database.update_task(task_id, **update_data)
+    if updated_task:
+        await notify_room(updated_task.room_id, {"type": "task_updated", "task": updated_task}, task_seq(updated_task))
+    return updated_task
+
+async def toggle_task_and_notify(task_id: int):
+    updated_task = await Database.toggle_task(task_id)
+    if updated_task:
+        await notify_room(updated_task.room_id, {"type": "task_updated", "task": updated_task}, task_seq(updated_task))
+    return updated_task
+
+async def delete_task_and_notify(task_id: int, permanent: bool):
+    task = await Database.delete_task(task_id, soft_delete=not permanent)
+    if task:
+        await notify_room(task.room_id, {"type": "task_deleted", "task_id": task_id, "permanent": permanent}, task_seq(task))
+    return task
+
+async def restore_task_and_notify(task_id: int):
+    restored_task = await Database.restore_task(task_id)
+    if restored_task:
+        await notify_room(restored_task.room_id, {"type": "task_restored", "task": restored_task}, task_seq(restored_task))
+    return restored_task
 
 @app.post("/tasks", response_model=Task)
 async def create_task(task: TaskCreate):
     try:
         print(f"Received task data: {task.dict()}")
-        new_task = await Database.create_task(
-            text=task.text,
-            creator=task.creator,
-            room_id=task.room_id,
-            priority=task.priority,
-            due_date=task.due_date,
-            tags=task.tags,
-            description=task.description
-        )
-        await manager.broadcast_to_room(
-            room_id=task.room_id,
-            message={"type": "task_created", "task": dict(new_task)}
-        )
-        return new_task
+        return FastJSONResponse(await create_task_and_notify(task))
     except Exception as e:
         print(f"Error creating task: {str(e)}")
         print(f"Task data: {task.dict()}")
@@ -67,89 +267,258 @@ async def create_task(task: TaskCreate):
 
 @app.put("/tasks/{task_id}", response_model=Optional[Task])
 async def update_task(task_id: int, task_update: TaskUpdate):
-    # 只传递非None的字段
-    update_data = {k: v for k, v in task_update.dict().items() if v is not None}
-    updated_task = await Database.update_task(task_id, **update_data)
-    if updated_task:
-        await manager.broadcast_to_room(
-            room_id=updated_task.room_id,
-            message={"type": "task_updated", "task": dict(updated_task)}
-        )
-    return updated_task
+    return FastJSONResponse(await update_task_and_notify(task_id, task_update))
 
 @app.patch("/tasks/{task_id}/toggle", response_model=Optional[Task])
 async def toggle_task(task_id: int):
     """快速切换任务完成状态"""
-    # 先获取当前任务状态
-    task = await Database.get_task_by_id(task_id)
-    if task:
-        updated_task = await Database.update_task(task_id, completed=not task.completed)
-        if updated_task:
-            await manager.broadcast_to_room(
-                room_id=updated_task.room_id,
-                message={"type": "task_updated", "task": dict(updated_task)}
-            )
-        return updated_task
-    return None
+    return FastJSONResponse(await toggle_task_and_notify(task_id))
 
 @app.delete("/tasks/{task_id}")
 async def delete_task(task_id: int, permanent: bool = False):
     """删除任务（默认软删除）"""
-    # 获取任务信息用于广播
-    task = await Database.get_task_by_id(task_id)
-    if task:
-        await Database.delete_task(task_id, soft_delete=not permanent)
-        await manager.broadcast_to_room(
-            room_id=task.room_id,
-            message={"type": "task_deleted", "task_id": task_id, "permanent": permanent}
-        )
+    await delete_task_and_notify(task_id, permanent)
     return {"status": "success"}
 
+# 单个批量请求最多包含的操作数
+TASK_BATCH_LIMIT = 1000
+
+@app.post("/rooms/{room_id}/tasks/batch", response_model=TaskBatchResponse)
+async def apply_task_batch(room_id: str, batch: TaskBatchRequest):
+    """批量创建/更新/删除/恢复任务：一个事务，一次广播"""
+    if len(batch.operations) > TASK_BATCH_LIMIT:
+        raise HTTPException(status_code=413, detail=f"单次最多{TASK_BATCH_LIMIT}个操作")
+    results, seq = await Database.apply_task_batch(room_id, batch.operations)
+
+    # 广播每个受影响任务的最终状态
+    tasks = {}
+    deleted = {}
+    for result in results:
+        if result.status != "ok":
+            continue
+        if result.task is None:
+            deleted[result.task_id] = True
+        elif result.task.is_deleted:
+            deleted[result.task_id] = False
+        else:
+            tasks[result.task_id] = result.task
+    if tasks or deleted:
+        await notify_room(room_id, {
+            "type": "tasks_batch",
+            "tasks": list(tasks.values()),
+            "deleted": [
+                {"task_id": task_id, "permanent": permanent}
+                for task_id, permanent in deleted.items()
+            ],
+        }, seq)
+    return FastJSONResponse(construct(TaskBatchResponse, results=results))
+
+@app.get("/rooms/{room_id}/export")
+async def export_room_tasks(
+    room_id: str,
+    format: TransferFormat = TransferFormat.NDJSON,
+    include_deleted: bool = False,
+):
+    """流式导出房间任务（NDJSON或CSV），按块读取数据库，不会把整个房间放进内存"""
+    if not await Database.get_room(room_id):
+        raise HTTPException(status_code=404, detail="Room not found")
+    chunks = Database.iter_tasks(room_id, include_deleted=include_deleted, chunk_size=EXPORT_CHUNK_SIZE)
+    return StreamingResponse(
+        export_tasks(format, chunks),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": export_disposition(room_id, format)},
+    )
+
+async def import_batch(job, room_id: str, rows):
+    items, errors = validate_rows(rows)
+    job.add_errors(errors)
+    if not items:
+        await imports.save(job)
+        return
+    tasks, seq = await Database.import_tasks(room_id, items)
+    job.imported += len(tasks)
+    job.batches += 1
+    await imports.save(job)
+    await notify_room(room_id, {
+        "type": "tasks_batch",
+        "tasks": [task for task in tasks if not task.is_deleted],
+        "deleted": [],
+    }, seq)
+    print(f"导入 {job.job_id}: 房间 {room_id} 已导入 {job.imported} 个任务，失败 {job.failed} 行")
+
+@app.post("/rooms/{room_id}/import")
+async def import_room_tasks(
+    room_id: str,
+    request: Request,
+    format: TransferFormat = TransferFormat.NDJSON,
+    job_id: Optional[str] = Query(None, max_length=64),
+):
+    """从NDJSON或CSV请求体批量导入任务
+
+    边接收边解析，每IMPORT_BATCH_SIZE行写入一个事务并广播一次；不合法的行跳过并计入错误。
+    导入过程中可以用 GET /imports/{job_id} 查询进度。
+    """
+    if not await Database.get_room(room_id):
+        raise HTTPException(status_code=404, detail="Room not found")
+    job = await imports.create(room_id, format, job_id)
+    rows = []
+    try:
+        async for row in parse_rows(format, request.stream()):
+            job.rows += 1
+            rows.append((job.rows, row))
+            if len(rows) >= IMPORT_BATCH_SIZE:
+                await import_batch(job, room_id, rows)
+                rows = []
+        await import_batch(job, room_id, rows)
+    except (ImportFormatError, UnicodeDecodeError) as e:
+        job.finish("failed", str(e))
+        await imports.save(job)
+        return FastJSONResponse(job.to_dict(), status_code=400)
+    except Exception as e:
+        job.finish("failed", str(e))
+        print(f"导入 {job.job_id} 失败: {e}")
+        await imports.save(job)
+        raise
+    job.finish("done")
+    await imports.save(job)
+    return job.to_dict()
+
+@app.get("/imports/{job_id}")
+async def get_import_progress(job_id: str):
+    """导入进度，每批写入后更新"""
+    job = await imports.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
+
 @app.get("/rooms/{room_id}/trash", response_model=List[Task])
-async def get_trash_tasks(room_id: str):
+async def get_trash_tasks(room_id: str, request: Request):
     """获取垃圾桶中的任务"""
-    return await Database.get_deleted_tasks(room_id)
+    return await cached_task_list(room_id, "trash", request, Database.get_deleted_tasks)
 
 @app.post("/tasks/{task_id}/restore")
 async def restore_task(task_id: int):
     """从垃圾桶恢复任务"""
-    task = await Database.get_task_by_id(task_id)
-    if task:
-        await Database.restore_task(task_id)
-        restored_task = await Database.get_task_by_id(task_id)
-        if restored_task:
-            await manager.broadcast_to_room(
-                room_id=restored_task.room_id,
-                message={"type": "task_restored", "task": dict(restored_task)}
-            )
+    if await restore_task_and_notify(task_id):
         return {"status": "success"}
     return {"status": "not_found"}
 
 # WebSocket连接
+# 客户端应在 WS_IDLE_TIMEOUT 内至少发送一条消息，空闲时发送文本 "ping" 作为心跳。
+# {"type": "command", ...} 形式的文本是任务命令（见 TaskCommand），其他文本作为聊天消息广播
+PONG_FRAME = encode_json({"type": "pong"})
+
+async def run_task_command(command: TaskCommand, room_id: str, user_name: str):
+    """执行一条WebSocket任务命令，返回 (状态, 任务或None)"""
+    if command.action == TaskCommandAction.CREATE:
+        if not command.text:
+            return "invalid", None
+        task = await create_task_and_notify(TaskCreate(
+            text=command.text,
+            completed=bool(command.completed),
+            creator=user_name,
+            room_id=room_id,
+            priority=command.priority or Priority.MEDIUM,
+            due_date=command.due_date,
+            tags=command.tags or [],
+            description=command.description
+        ))
+        return "ok", task
+    if command.task_id is None:
+        return "invalid", None
+    # 连接只能操作自己房间的任务，和批量接口一样把其他房间的id当作不存在
+    # （任务创建后room_id不会再改变，先检查再写入没有竞争问题）
+    existing = await Database.get_task_by_id(command.task_id)
+    if existing is None or existing.room_id != room_id:
+        return "not_found", None
+    if command.action == TaskCommandAction.UPDATE:
+        task = await update_task_and_notify(command.task_id, TaskUpdate(**{
+            field: getattr(command, field)
+            for field in ("text", "completed", "priority", "due_date", "tags", "description")
+        }))
+    elif command.action == TaskCommandAction.TOGGLE:
+        task = await toggle_task_and_notify(command.task_id)
+    elif command.action == TaskCommandAction.DELETE:
+        task = await delete_task_and_notify(command.task_id, command.permanent)
+    else:
+        task = await restore_task_and_notify(command.task_id)
+    return ("ok", task) if task else ("not_found", None)
+
+async def handle_task_command(connection, room_id: str, user_name: str, payload: dict):
+    """执行命令并在同一个连接上回复确认
+
+    确认消息：{"type": "ack", "request_id", "status": ok/not_found/invalid/error, "task", "seq", "error"}。
+    事件本身照常通过广播发给房间内所有连接（包括发送命令的连接），确认排在事件之后。
+    """
+    request_id = payload.get("request_id")
+    ack = {"type": "ack", "request_id": request_id}
+    try:
+        command = TaskCommand(**payload)
+    except ValidationError as e:
+        ack.update(status="invalid", error=str(e))
+    else:
+        try:
+            status, task = await run_task_command(command, room_id, user_name)
+        except Exception as e:
+            print(f"WebSocket命令执行失败: {e}")
+            ack.update(status="error", error=str(e))
+        else:
+            ack["status"] = status
+            if task is not None:
+                ack.update(task_id=task.id, task=task, seq=task.seq)
+    connection.enqueue(encode_json(ack))
+
+async def resume_connection(connection, room_id: str, last_seq: int):
+    """补发客户端断线期间错过的任务事件
+
+    内存事件日志中从last_seq到当前序号的事件链完整时只补发缺失的事件，
+    否则发送一个全量快照 {"type": "snapshot", "seq", "tasks"}。
+    客户端应忽略 seq 不大于已处理序号的事件；收到 prev_seq 大于已处理序号的事件说明有缺口，
+    应带上 last_seq 重连。
+    """
+    current_seq = await Database.get_room_seq(room_id)
+    frames = manager.event_log.replay(room_id, last_seq, current_seq)
+    if frames is None:
+        seq, tasks = await Database.get_room_snapshot(room_id)
+        frames = [encode_json({"type": "snapshot", "seq": seq, "tasks": tasks})]
+    connection.resume(frames)
+
 @app.websocket("/ws/{room_id}/{user_name}")
-async def websocket_endpoint(websocket: WebSocket, room_id: str, user_name: str):
-    await manager.connect(websocket, room_id, user_name)
+async def websocket_endpoint(websocket: WebSocket, room_id: str, user_name: str, last_seq: Optional[int] = None):
+    # 带last_seq重连时先暂停发送，补发的事件排在新事件之前
+    connection, joined = await manager.connect(websocket, room_id, user_name, paused=last_seq is not None)
     try:
-        room = await Database.get_room(room_id)
-        if room:
-            active_users = room.active_users + [user_name]
-            await Database.update_room_users(room.id, active_users)
+        if last_seq is not None:
+            await resume_connection(connection, room_id, last_seq)
+        # 同一用户的其他设备已在线时不重复通知
+        if joined:
             await manager.broadcast_to_room(
                 room_id=room_id,
                 message={"type": "user_joined", "user_name": user_name}
             )
-        
+
         while True:
             data = await websocket.receive_text()
+            connection.touch()
+            if data == "ping":
+                connection.enqueue(PONG_FRAME)
+                continue
+            if data.startswith("{"):
+                try:
+                    payload = decode_json(data)
+                except ValueError:
+                    payload = None
+                if isinstance(payload, dict) and payload.get("type") == "command":
+                    await handle_task_command(connection, room_id, user_name, payload)
+                    continue
             await manager.broadcast_to_room(
                 room_id=room_id,
                 message={"type": "message", "user": user_name, "content": data}
             )
     except WebSocketDisconnect:
-        manager.disconnect(room_id, user_name)
-        if room:
-            active_users = [u for u in room.active_users if u != user_name]
-            await Database.update_room_users(room.id, active_users)
+        pass
+    finally:
+        if await manager.disconnect(connection):
             await manager.broadcast_to_room(
                 room_id=room_id,
                 message={"type": "user_left", "user_name": user_name}
@@ -0,0 +1,194 @@
+"""
+后台数据库维护
+
+定期执行：
+- 永久删除回收站中超过保留期的任务
+- 把长时间没有变化的已完成任务移到 tasks_archive（默认关闭，归档后的任务不再出现在任何接口中）
+- 清理旧的墓碑记录（增量同步落后太多的客户端会收到全量快照）
+- PRAGMA incremental_vacuum 归还空闲页，PRAGMA optimize 更新统计信息
+
+删除和归档按小批次分多个事务执行，批次之间让出写连接，不会长时间阻塞正常请求。
+多worker部署时只有抢到文件锁的那个进程执行维护；分片部署时依次维护每个分片。
+"""
+
+import os
+import fcntl
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from database import Database, DATABASE_URL
+from sharding import DATABASE_SHARDS
+
+# 维护间隔（秒），0表示关闭后台维护
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+# 启动后第一次维护的延迟（秒）
+MAINTENANCE_INITIAL_DELAY = float(os.getenv("MAINTENANCE_INITIAL_DELAY", "60"))
+# 回收站保留天数，0表示不自动清理
+TRASH_RETENTION_DAYS = float(os.getenv("TRASH_RETENTION_DAYS", "30"))
+# 已完成任务超过多少天没有变化就归档，0表示不归档（默认）；
+# 目前没有读取或恢复归档的接口，对用户来说归档的任务就是消失了，只在需要控制数据库大小时开启
+ARCHIVE_COMPLETED_DAYS = float(os.getenv("ARCHIVE_COMPLETED_DAYS", "0"))
+# 增量同步保留最近多少个版本的墓碑记录，0表示不清理
+TOMBSTONE_KEEP_REVS = int(os.getenv("TOMBSTONE_KEEP_REVS", "1000000"))
+# 每个事务处理的行数，以及批次之间的停顿（秒）
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+MAINTENANCE_BATCH_PAUSE = float(os.getenv("MAINTENANCE_BATCH_PAUSE", "0.05"))
+# 每次维护最多归还的空闲页数
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "2000"))
+
+# 每个房间被删除的任务id和事件序号
+RemovedTasks = Dict[str, Tuple[List[int], Tuple[int, int]]]
+# 任务被永久删除后通知房间：notify(room_id, task_ids, seq)
+RemovalNotifier = Callable[[str, List[int], Tuple[int, int]], Awaitable[None]]
+
+
+class MaintenanceScheduler:
+    def __init__(self, notify: Optional[RemovalNotifier] = None, interval: float = MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self.notify = notify
+        self.is_runner = False
+        self.running = False
+        self.runs = 0
+        self.last_started: Optional[datetime] = None
+        self.last_finished: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.last_result: Dict[str, Any] = {}
+        self.totals = {"purged": 0, "archived": 0, "tombstones_pruned": 0, "freed_pages": 0}
+        self._lock_file = None
+        self._task: Optional[asyncio.Task] = None
+        self._run_lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    async def start(self):
+        if not self.enabled or self._task:
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_runner = False
+
+    def _try_lock(self) -> bool:
+        """同一个数据库只由一个进程维护；锁随进程退出自动释放，其他worker下一轮接替"""
+        if self._lock_file:
+            return True
+        lock_file = open(DATABASE_URL + ".maintenance.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _loop(self):
+        await asyncio.sleep(min(MAINTENANCE_INITIAL_DELAY, self.interval))
+        while True:
+            self.is_runner = self._try_lock()
+            if self.is_runner:
+                try:
+                    await self.run_once()
+                except Exception as e:
+                    print(f"数据库维护失败: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> Dict[str, Any]:
+        """执行一轮维护，返回本轮的统计"""
+        async with self._run_lock:
+            self.running = True
+            self.last_started = datetime.utcnow()
+            self.last_error = None
+            result = {"purged": 0, "archived": 0, "tombstones_pruned": 0, "freed_pages": 0, "size_bytes": 0}
+            try:
+                for shard in range(DATABASE_SHARDS):
+                    await self._run_shard(shard, result)
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            finally:
+                self.running = False
+                self.last_finished = datetime.utcnow()
+                self.runs += 1
+                self.last_result = result
+                for key in self.totals:
+                    self.totals[key] += result.get(key, 0)
+            return result
+
+    async def _run_shard(self, shard: int, result: Dict[str, Any]):
+        now = datetime.utcnow()
+        if TRASH_RETENTION_DAYS > 0:
+            cutoff = now - timedelta(days=TRASH_RETENTION_DAYS)
+            result["purged"] += await self._drain(
+                lambda: Database.purge_trash(cutoff, MAINTENANCE_BATCH_SIZE, shard=shard)
+            )
+        if ARCHIVE_COMPLETED_DAYS > 0:
+            cutoff = now - timedelta(days=ARCHIVE_COMPLETED_DAYS)
+            result["archived"] += await self._drain(
+                lambda: Database.archive_completed(cutoff, MAINTENANCE_BATCH_SIZE, shard=shard)
+            )
+        if TOMBSTONE_KEEP_REVS > 0:
+            while True:
+                pruned = await Database.prune_tombstones(TOMBSTONE_KEEP_REVS, MAINTENANCE_BATCH_SIZE, shard=shard)
+                result["tombstones_pruned"] += pruned
+                if pruned < MAINTENANCE_BATCH_SIZE:
+                    break
+                await asyncio.sleep(MAINTENANCE_BATCH_PAUSE)
+        vacuum = await Database.vacuum(MAINTENANCE_VACUUM_PAGES, shard=shard)
+        result["freed_pages"] += vacuum["freed_pages"]
+        result["size_bytes"] += vacuum["size_bytes"]
+        # 每个分片的vacuum模式和剩余空闲页
+        result.setdefault("shards", []).append({
+            "shard": shard,
+            "auto_vacuum": vacuum["auto_vacuum"],
+            "freelist_pages": vacuum["freelist_pages"],
+            "size_bytes": vacuum["size_bytes"],
+        })
+
+    async def _drain(self, batch: Callable[[], Awaitable[RemovedTasks]]) -> int:
+        """反复执行一个批次直到没有剩余，返回处理的总行数"""
+        total = 0
+        while True:
+            removed = await batch()
+            count = sum(len(task_ids) for task_ids, _ in removed.values())
+            total += count
+            if self.notify:
+                for room_id, (task_ids, seq) in removed.items():
+                    await self.notify(room_id, task_ids, seq)
+            if count < MAINTENANCE_BATCH_SIZE:
+                return total
+            await asyncio.sleep(MAINTENANCE_BATCH_PAUSE)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "runner": self.is_runner,
+            "running": self.running,
+            "interval": self.interval,
+            "runs": self.runs,
+            "last_started": self.last_started,
+            "last_finished": self.last_finished,
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+            "totals": self.totals,
+            "config": {
+                "trash_retention_days": TRASH_RETENTION_DAYS,
+                "archive_completed_days": ARCHIVE_COMPLETED_DAYS,
+                "tombstone_keep_revs": TOMBSTONE_KEEP_REVS,
+                "batch_size": MAINTENANCE_BATCH_SIZE,
+                "vacuum_pages": MAINTENANCE_VACUUM_PAGES,
+                "shards": DATABASE_SHARDS,
+            },
+        }
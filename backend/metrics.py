@@ -0,0 +1,304 @@
+"""
+运行指标
+
+GET /metrics 以Prometheus文本格式输出本进程的指标：
+- 耗时类指标（HTTP请求、Database调用、连接池等待、WebSocket发送）在发生时记入直方图；
+- 状态类指标（连接数、发送队列、缓存、写队列、事件日志、后台维护）在抓取时从各组件读取。
+
+指标只统计本进程，多worker部署时每个worker分别抓取（todo_worker_info 标出是哪个进程）。
+SLOW_QUERY_MS / SLOW_REQUEST_MS 大于0时，超过阈值的Database调用和HTTP请求会打印到日志。
+"""
+
+import os
+import time
+import bisect
+import functools
+import inspect
+from datetime import timezone
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+# 慢查询和慢请求日志的阈值（毫秒），0表示关闭
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 延迟直方图的桶（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 抓取时生成的指标：(名称, 类型, 说明, [(标签, 值)])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # 标签 -> [每个桶的计数（不累加）..., 总和, 次数]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, entry in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), entry):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(entry[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {entry[-1]}")
+        return lines
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "todo_http_request_duration_seconds", "HTTP请求耗时（按路由模板）", ("method", "route", "status")
+)
+DB_QUERY_SECONDS = Histogram("todo_db_query_duration_seconds", "Database方法耗时，含等待连接和写锁", ("query",))
+DB_QUERY_ROWS = Counter("todo_db_query_rows_total", "Database方法返回或影响的行数", ("query",))
+DB_QUERY_ERRORS = Counter("todo_db_query_errors_total", "Database方法抛出的异常", ("query",))
+DB_POOL_WAIT_SECONDS = Histogram(
+    "todo_db_pool_wait_seconds", "从连接池借出连接的等待时间", ("shard", "kind")
+)
+WS_SEND_SECONDS = Histogram(
+    "todo_ws_send_latency_seconds", "WebSocket消息从入队到发送完成的时间"
+)
+WS_DROPPED_FRAMES = Counter("todo_ws_dropped_frames_total", "发送队列满时丢弃或合并的消息", ("policy",))
+WS_REAPED = Counter("todo_ws_reaped_connections_total", "因发送失败、队列溢出或空闲超时被断开的连接", ("code",))
+
+REGISTRY = [
+    HTTP_REQUEST_SECONDS, DB_QUERY_SECONDS, DB_QUERY_ROWS, DB_QUERY_ERRORS,
+    DB_POOL_WAIT_SECONDS, WS_SEND_SECONDS, WS_DROPPED_FRAMES, WS_REAPED,
+]
+
+
+def render(*families: Iterable[Family]) -> str:
+    """输出已注册的指标，以及抓取时生成的指标"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for group in families:
+        for name, kind, help, samples in group:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------- 请求和数据库调用
+
+def _route_of(scope) -> str:
+    route = scope.get("route")
+    # 未匹配任何路由的请求（404）合并为一个标签，避免标签数量失控
+    return getattr(route, "path", None) or "unmatched"
+
+
+class RequestMetricsMiddleware:
+    """记录每个HTTP请求的耗时（直到响应体发送完），按路由模板而不是实际路径分组"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = _route_of(scope)
+            HTTP_REQUEST_SECONDS.observe(elapsed, scope["method"], route, str(status))
+            if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS:
+                query = scope.get("query_string", b"").decode("latin-1")
+                path = scope["path"] + (f"?{query}" if query else "")
+                print(f"慢请求 {scope['method']} {path} -> {status}: {elapsed * 1000:.1f}ms")
+
+
+def result_rows(result: Any) -> int:
+    """Database方法结果对应的行数：列表按长度，(结果, 序号) 按其中的列表，单个记录或标量算1行"""
+    if result is None or isinstance(result, bool):
+        return 0
+    if isinstance(result, (list, set)):
+        return len(result)
+    if isinstance(result, tuple):
+        return sum(result_rows(item) for item in result if isinstance(item, (list, dict)))
+    if isinstance(result, dict):
+        return sum(result_rows(value) for value in result.values() if isinstance(value, (list, tuple)))
+    return 1
+
+
+def _describe_args(args: tuple, kwargs: dict) -> str:
+    parts = [repr(arg)[:60] for arg in args[:3]]
+    parts.extend(f"{key}={value!r}"[:60] for key, value in kwargs.items() if value is not None)
+    return ", ".join(parts)
+
+
+def _timed_query(name: str, func: Callable):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        rows = 0
+        try:
+            result = await func(*args, **kwargs)
+            rows = result_rows(result)
+            return result
+        except Exception:
+            DB_QUERY_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_QUERY_SECONDS.observe(elapsed, name)
+            DB_QUERY_ROWS.inc(name, amount=rows)
+            if SLOW_QUERY_MS > 0 and elapsed * 1000 >= SLOW_QUERY_MS:
+                print(f"慢查询 {name}({_describe_args(args, kwargs)}): {elapsed * 1000:.1f}ms, {rows}行")
+    return wrapper
+
+
+def instrument_queries(cls):
+    """为类中所有公开的异步静态方法记录耗时和行数；方法名就是指标中的query标签"""
+    for name, attr in list(vars(cls).items()):
+        if name.startswith("_") or not isinstance(attr, staticmethod):
+            continue
+        if inspect.iscoroutinefunction(attr.__func__):
+            setattr(cls, name, staticmethod(_timed_query(name, attr.__func__)))
+    return cls
+
+
+# ---------------------------------------------------------------- 抓取时读取的状态
+
+def worker_families(worker: str) -> List[Family]:
+    return [("todo_worker_info", "gauge", "输出这些指标的进程", [({"worker": worker}, 1)])]
+
+
+def database_families(shards) -> List[Family]:
+    readers_total, readers_in_use, writer_busy = [], [], []
+    queue_depth, queue_batches, queue_operations = [], [], []
+    for shard in shards:
+        label = {"shard": shard.index}
+        pool = shard.pool
+        readers_total.append((label, pool.size if pool.is_open else 0))
+        readers_in_use.append((label, pool.readers_in_use))
+        writer_busy.append((label, 1 if pool.writer_busy else 0))
+        queue = shard.write_queue
+        queue_depth.append((label, queue.depth))
+        queue_batches.append((label, queue.batches))
+        queue_operations.append((label, queue.operations))
+    return [
+        ("todo_db_pool_readers", "gauge", "连接池中的只读连接数", readers_total),
+        ("todo_db_pool_readers_in_use", "gauge", "正在使用的只读连接数", readers_in_use),
+        ("todo_db_pool_writer_busy", "gauge", "写连接是否被占用", writer_busy),
+        ("todo_db_write_queue_depth", "gauge", "组提交写队列中等待的写操作", queue_depth),
+        ("todo_db_write_queue_batches_total", "counter", "组提交的批次数", queue_batches),
+        ("todo_db_write_queue_operations_total", "counter", "组提交执行的写操作数", queue_operations),
+    ]
+
+
+def connection_families(manager) -> List[Family]:
+    # 房间token就是进入房间的凭证，/metrics 没有鉴权，只输出汇总值，不按房间打标签
+    rooms = connections = queued = dropped = 0
+    max_connections = max_depth = 0
+    for room_connections in manager.active_connections.values():
+        if not room_connections:
+            continue
+        depths = [connection.queue_depth for connection in room_connections]
+        rooms += 1
+        connections += len(room_connections)
+        max_connections = max(max_connections, len(room_connections))
+        queued += sum(depths)
+        dropped += sum(connection.dropped for connection in room_connections)
+        max_depth = max([max_depth, *depths])
+    users = sum(len(room_users) for room_users in manager.presence.values())
+    log = manager.event_log.stats()
+    return [
+        ("todo_ws_rooms", "gauge", "有WebSocket连接的房间数", [({}, rooms)]),
+        ("todo_ws_connections", "gauge", "WebSocket连接数", [({}, connections)]),
+        ("todo_ws_room_max_connections", "gauge", "单个房间的最大WebSocket连接数", [({}, max_connections)]),
+        ("todo_ws_online_users", "gauge", "在线用户数（同一用户多个连接算一个）", [({}, users)]),
+        ("todo_ws_send_queue_frames", "gauge", "所有连接发送队列中的消息数", [({}, queued)]),
+        ("todo_ws_send_queue_max_frames", "gauge", "单个连接发送队列的最大长度", [({}, max_depth)]),
+        ("todo_ws_connection_dropped_frames", "gauge", "当前连接累计被丢弃的消息数", [({}, dropped)]),
+        ("todo_event_log_rooms", "gauge", "事件日志中保留事件的房间数", [({}, log["rooms"])]),
+        ("todo_event_log_events", "gauge", "事件日志中保留的事件数", [({}, log["events"])]),
+        ("todo_event_log_bytes", "gauge", "事件日志估算占用的内存", [({}, log["bytes"])]),
+    ]
+
+
+def cache_families(cache) -> List[Family]:
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    return [
+        ("todo_room_cache_hits_total", "counter", "任务列表缓存命中", [({}, stats["hits"])]),
+        ("todo_room_cache_misses_total", "counter", "任务列表缓存未命中", [({}, stats["misses"])]),
+        ("todo_room_cache_evictions_total", "counter", "超出内存预算被淘汰的缓存项", [({}, stats["evictions"])]),
+        ("todo_room_cache_hit_ratio", "gauge", "进程启动以来的缓存命中率",
+         [({}, stats["hits"] / lookups if lookups else 0)]),
+        ("todo_room_cache_entries", "gauge", "缓存项数", [({}, stats["entries"])]),
+        ("todo_room_cache_bytes", "gauge", "缓存估算占用的内存", [({}, stats["bytes"])]),
+    ]
+
+
+def maintenance_families(status: Dict[str, Any]) -> List[Family]:
+    totals = status["totals"]
+    finished = status["last_finished"]
+    return [
+        ("todo_maintenance_runner", "gauge", "本进程是否负责后台维护", [({}, 1 if status["runner"] else 0)]),
+        ("todo_maintenance_running", "gauge", "后台维护是否正在执行", [({}, 1 if status["running"] else 0)]),
+        ("todo_maintenance_runs_total", "counter", "后台维护执行次数", [({}, status["runs"])]),
+        ("todo_maintenance_rows_total", "counter", "后台维护处理的行数",
+         [({"action": action}, value) for action, value in sorted(totals.items())]),
+        ("todo_maintenance_last_finished_timestamp_seconds", "gauge", "最近一次维护结束的时间",
+         [({}, finished.replace(tzinfo=timezone.utc).timestamp() if finished else 0)]),
+    ]
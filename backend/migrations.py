@@ -0,0 +1,471 @@
+"""
+数据库结构迁移
+
+每个迁移有一个递增的版本号，当前版本记录在 PRAGMA user_version 中。
+Database.init_db 和 init_db.py 都通过 migrate() 建表和升级已有的 todo.db，
+新增表结构时只需要在 MIGRATIONS 末尾追加一项。
+"""
+
+import ast
+import json
+import sqlite3
+from typing import Callable, List, Tuple
+
+
+def _column_names(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _add_column(conn: sqlite3.Connection, table: str, definition: str):
+    """添加字段；早期版本可能已经手动加过，存在时跳过"""
+    name = definition.split()[0]
+    if name not in _column_names(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+
+
+def _initial_schema(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rooms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP NOT NULL,
+            active_users TEXT DEFAULT '[]'
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            completed BOOLEAN NOT NULL DEFAULT 0,
+            creator TEXT NOT NULL,
+            room_id TEXT NOT NULL,
+            priority TEXT DEFAULT 'medium',
+            due_date TIMESTAMP,
+            tags TEXT DEFAULT '[]',
+            description TEXT,
+            is_deleted BOOLEAN NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP,
+            deleted_at TIMESTAMP
+        )
+    """)
+    # 很早的数据库是先建表后补字段的
+    for definition in (
+        "priority TEXT DEFAULT 'medium'",
+        "due_date TIMESTAMP",
+        "tags TEXT DEFAULT '[]'",
+        "description TEXT",
+        "is_deleted BOOLEAN NOT NULL DEFAULT 0",
+        "updated_at TIMESTAMP",
+        "deleted_at TIMESTAMP",
+    ):
+        _add_column(conn, "tasks", definition)
+
+
+def _sync_schema(conn: sqlite3.Connection):
+    """增量同步：任务版本号、房间版本号和永久删除的墓碑记录
+
+    版本号由触发器维护，所有写入路径（包括直接写SQL）都会自动推进版本。
+    """
+    _add_column(conn, "tasks", "rev INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            rev INTEGER NOT NULL DEFAULT 0,
+            tombstone_floor INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO sync_state (id, rev, tombstone_floor) VALUES (1, 0, 0)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS room_revs (
+            room_id TEXT PRIMARY KEY,
+            rev INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS task_tombstones (
+            task_id INTEGER PRIMARY KEY,
+            room_id TEXT NOT NULL,
+            rev INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_room_rev ON tasks (room_id, rev)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tombstones_room_rev ON task_tombstones (room_id, rev)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tasks_sync_insert AFTER INSERT ON tasks
+        BEGIN
+            UPDATE sync_state SET rev = rev + 1;
+            UPDATE tasks SET rev = (SELECT rev FROM sync_state) WHERE id = NEW.id;
+            INSERT OR REPLACE INTO room_revs (room_id, rev)
+                VALUES (NEW.room_id, (SELECT rev FROM sync_state));
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tasks_sync_update AFTER UPDATE ON tasks
+        WHEN NEW.rev IS OLD.rev
+        BEGIN
+            UPDATE sync_state SET rev = rev + 1;
+            UPDATE tasks SET rev = (SELECT rev FROM sync_state) WHERE id = NEW.id;
+            INSERT OR REPLACE INTO room_revs (room_id, rev)
+                VALUES (NEW.room_id, (SELECT rev FROM sync_state));
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tasks_sync_delete AFTER DELETE ON tasks
+        BEGIN
+            UPDATE sync_state SET rev = rev + 1;
+            INSERT OR REPLACE INTO task_tombstones (task_id, room_id, rev)
+                VALUES (OLD.id, OLD.room_id, (SELECT rev FROM sync_state));
+            INSERT OR REPLACE INTO room_revs (room_id, rev)
+                VALUES (OLD.room_id, (SELECT rev FROM sync_state));
+        END
+    """)
+
+
+def _room_list_indexes(conn: sqlite3.Connection):
+    """房间任务列表和垃圾桶查询的覆盖索引，避免全表扫描和额外排序"""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_room_active "
+        "ON tasks (room_id, is_deleted, created_at)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_room_trash "
+        "ON tasks (room_id, is_deleted, deleted_at)"
+    )
+
+
+def _parse_legacy_tags(value: str) -> List[str]:
+    """旧版本用str(list)保存标签，用literal_eval安全地解析"""
+    try:
+        return json.loads(value)
+    except ValueError:
+        pass
+    try:
+        tags = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return []
+    return [str(tag) for tag in tags] if isinstance(tags, (list, tuple)) else []
+
+
+def _json_tags(conn: sqlite3.Connection):
+    """标签改为JSON存储，并建立规范化的task_tags索引表，由触发器保持同步"""
+    rows = conn.execute(
+        "SELECT id, tags FROM tasks WHERE tags IS NOT NULL AND json_valid(tags) = 0"
+    ).fetchall()
+    conn.executemany(
+        "UPDATE tasks SET tags = ? WHERE id = ?",
+        [(json.dumps(_parse_legacy_tags(tags), ensure_ascii=False), task_id) for task_id, tags in rows]
+    )
+    conn.execute("UPDATE tasks SET tags = '[]' WHERE tags IS NULL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS task_tags (
+            task_id INTEGER NOT NULL,
+            room_id TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (task_id, tag)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_task_tags_room_tag ON task_tags (room_id, tag)")
+    conn.execute("""
+        INSERT OR IGNORE INTO task_tags (task_id, room_id, tag)
+        SELECT tasks.id, tasks.room_id, json_each.value FROM tasks, json_each(tasks.tags)
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS task_tags_insert AFTER INSERT ON tasks
+        BEGIN
+            INSERT OR IGNORE INTO task_tags (task_id, room_id, tag)
+                SELECT NEW.id, NEW.room_id, value FROM json_each(NEW.tags);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS task_tags_update AFTER UPDATE OF tags ON tasks
+        WHEN NEW.tags IS NOT OLD.tags
+        BEGIN
+            DELETE FROM task_tags WHERE task_id = NEW.id;
+            INSERT OR IGNORE INTO task_tags (task_id, room_id, tag)
+                SELECT NEW.id, NEW.room_id, value FROM json_each(NEW.tags);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS task_tags_delete AFTER DELETE ON tasks
+        BEGIN
+            DELETE FROM task_tags WHERE task_id = OLD.id;
+        END
+    """)
+
+
+# 任务列表的排序表达式，查询时必须与索引中的表达式完全一致才能用上索引
+PRIORITY_RANK_SQL = (
+    "(CASE priority WHEN 'low' THEN 0 WHEN 'medium' THEN 1 "
+    "WHEN 'high' THEN 2 WHEN 'urgent' THEN 3 ELSE 1 END)"
+)
+DUE_SORT_SQL = "COALESCE(due_date, '9999-12-31T23:59:59')"
+UPDATED_SORT_SQL = "COALESCE(updated_at, created_at)"
+
+
+def _task_sort_indexes(conn: sqlite3.Connection):
+    """服务端筛选、排序和分页用的索引"""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_room_completed "
+        "ON tasks (room_id, is_deleted, completed, created_at)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_room_due "
+        f"ON tasks (room_id, is_deleted, {DUE_SORT_SQL}, id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_room_priority "
+        f"ON tasks (room_id, is_deleted, {PRIORITY_RANK_SQL}, id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_room_updated "
+        f"ON tasks (room_id, is_deleted, {UPDATED_SORT_SQL}, id)"
+    )
+
+
+def _task_search(conn: sqlite3.Connection):
+    """任务标题和描述的全文索引
+
+    使用外部内容表，不重复存储文本；trigram分词支持中文等没有空格分词的文本的子串搜索。
+    索引由触发器维护，rev等其他字段的更新不会触发重建。
+    """
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            text, description,
+            content='tasks', content_rowid='id', tokenize='trigram'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks
+        BEGIN
+            INSERT INTO tasks_fts (rowid, text, description)
+                VALUES (NEW.id, NEW.text, NEW.description);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF text, description ON tasks
+        BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, text, description)
+                VALUES ('delete', OLD.id, OLD.text, OLD.description);
+            INSERT INTO tasks_fts (rowid, text, description)
+                VALUES (NEW.id, NEW.text, NEW.description);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks
+        BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, text, description)
+                VALUES ('delete', OLD.id, OLD.text, OLD.description);
+        END
+    """)
+    conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+
+
+def _room_presence(conn: sqlite3.Connection):
+    """各worker定期写入的房间在线用户快照，rooms.active_users不再使用"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS room_presence (
+            room_id TEXT NOT NULL,
+            worker TEXT NOT NULL,
+            users TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (room_id, worker)
+        ) WITHOUT ROWID
+    """)
+
+
+def _room_event_seq(conn: sqlite3.Connection):
+    """房间事件序号：每个任务行的变更使房间的seq加1，连续递增，用于WebSocket断线续传
+
+    rev是全局版本号，不同房间共用，同一房间内不连续；seq按房间连续，
+    客户端可以据此判断是否漏掉了事件。
+    """
+    _add_column(conn, "room_revs", "seq INTEGER NOT NULL DEFAULT 0")
+    for name in ("tasks_sync_insert", "tasks_sync_update", "tasks_sync_delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute("""
+        CREATE TRIGGER tasks_sync_insert AFTER INSERT ON tasks
+        BEGIN
+            UPDATE sync_state SET rev = rev + 1;
+            UPDATE tasks SET rev = (SELECT rev FROM sync_state) WHERE id = NEW.id;
+            INSERT INTO room_revs (room_id, rev, seq) VALUES (NEW.room_id, (SELECT rev FROM sync_state), 1)
+                ON CONFLICT (room_id) DO UPDATE SET rev = excluded.rev, seq = seq + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER tasks_sync_update AFTER UPDATE ON tasks
+        WHEN NEW.rev IS OLD.rev
+        BEGIN
+            UPDATE sync_state SET rev = rev + 1;
+            UPDATE tasks SET rev = (SELECT rev FROM sync_state) WHERE id = NEW.id;
+            INSERT INTO room_revs (room_id, rev, seq) VALUES (NEW.room_id, (SELECT rev FROM sync_state), 1)
+                ON CONFLICT (room_id) DO UPDATE SET rev = excluded.rev, seq = seq + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER tasks_sync_delete AFTER DELETE ON tasks
+        BEGIN
+            UPDATE sync_state SET rev = rev + 1;
+            INSERT OR REPLACE INTO task_tombstones (task_id, room_id, rev)
+                VALUES (OLD.id, OLD.room_id, (SELECT rev FROM sync_state));
+            INSERT INTO room_revs (room_id, rev, seq) VALUES (OLD.room_id, (SELECT rev FROM sync_state), 1)
+                ON CONFLICT (room_id) DO UPDATE SET rev = excluded.rev, seq = seq + 1;
+        END
+    """)
+
+
+def _maintenance(conn: sqlite3.Connection):
+    """后台维护：已完成任务的归档表，以及清理回收站、归档和清理墓碑时用到的索引"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tasks_archive (
+            id INTEGER PRIMARY KEY,
+            text TEXT NOT NULL,
+            completed BOOLEAN NOT NULL DEFAULT 1,
+            creator TEXT NOT NULL,
+            room_id TEXT NOT NULL,
+            priority TEXT DEFAULT 'medium',
+            due_date TIMESTAMP,
+            tags TEXT DEFAULT '[]',
+            description TEXT,
+            is_deleted BOOLEAN NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP,
+            deleted_at TIMESTAMP,
+            archived_at TIMESTAMP NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_archive_room ON tasks_archive (room_id, archived_at)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_trash_age ON tasks (deleted_at) WHERE is_deleted = 1"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_completed_age "
+        f"ON tasks ({UPDATED_SORT_SQL}) WHERE completed = 1 AND is_deleted = 0"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tombstones_rev ON task_tombstones (rev)")
+
+
+def _import_jobs(conn: sqlite3.Connection):
+    """批量导入的进度，多个worker都能查询；只使用分片0中的这张表"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            job_id TEXT PRIMARY KEY,
+            room_id TEXT NOT NULL,
+            format TEXT NOT NULL,
+            status TEXT NOT NULL,
+            rows INTEGER NOT NULL DEFAULT 0,
+            imported INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            batches INTEGER NOT NULL DEFAULT 0,
+            errors TEXT NOT NULL DEFAULT '[]',
+            started_at TIMESTAMP NOT NULL,
+            finished_at TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_import_jobs_started ON import_jobs (started_at)")
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "初始表结构", _initial_schema),
+    (2, "增量同步版本号", _sync_schema),
+    (3, "房间任务列表索引", _room_list_indexes),
+    (4, "标签JSON存储和标签索引表", _json_tags),
+    (5, "任务排序索引", _task_sort_indexes),
+    (6, "任务全文搜索", _task_search),
+    (7, "在线状态快照", _room_presence),
+    (8, "房间事件序号", _room_event_seq),
+    (9, "后台维护：归档表和索引", _maintenance),
+    (10, "导入进度", _import_jobs),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# 按分片划分id区间的表
+_SHARDED_ID_TABLES = ("tasks", "rooms")
+
+
+def _reserve_ids(conn: sqlite3.Connection, base: int):
+    """让任务和房间的AUTOINCREMENT从base之后分配id（分片各自使用不重叠的id区间）"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # 较早的版本只给任务划分了区间，分片中已有的房间id挪进本分片的区间；
+        # 没有其他表引用rooms.id，直接改写即可
+        conn.execute("UPDATE rooms SET id = id + ? WHERE id <= ?", (base, base))
+        for table in _SHARDED_ID_TABLES:
+            conn.execute(
+                f"UPDATE sqlite_sequence SET seq = MAX(?, (SELECT IFNULL(MAX(id), 0) FROM {table})) "
+                f"WHERE name = '{table}' AND seq <= ?",
+                (base, base)
+            )
+            conn.execute(
+                """INSERT INTO sqlite_sequence (name, seq) SELECT ?, ?
+                   WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)""",
+                (table, base, table)
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def migrate(path: str, id_base: int = 0) -> int:
+    """把数据库升级到最新版本，返回升级后的版本号
+
+    每个迁移在独立的 IMMEDIATE 事务中执行，失败时整体回滚；
+    多个进程同时启动时，后拿到写锁的进程会看到已更新的版本号并跳过。
+    id_base 是分片的任务和房间id起点，见 sharding.py。
+    """
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        # 新建的数据库使用增量vacuum，后台维护可以逐步归还空闲页；
+        # 已有数据库需要用 init_db.py --enable-incremental-vacuum 转换一次
+        if not conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        for version, name, apply in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version <= current:
+                    conn.execute("COMMIT")
+                    continue
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"数据库迁移到版本 {version}: {name}")
+        if id_base:
+            _reserve_ids(conn, id_base)
+        conn.execute("PRAGMA optimize")
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def rebuild_search_index(path: str):
+    """按tasks表重建全文索引，用于索引损坏或绕过触发器导入数据之后"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+            conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('optimize')")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def enable_incremental_vacuum(path: str):
+    """把已有数据库切换为增量vacuum模式，需要一次完整的VACUUM（会重写整个文件）"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
@@ -29,6 +29,33 @@ class Task(TaskBase):
     class Config:
         orm_mode = True
 
+class TaskSort(str, Enum):
+    CREATED_AT = "created_at"
+    DUE_DATE = "due_date"
+    PRIORITY = "priority"
+    UPDATED_AT = "updated_at"
+
+class SortOrder(str, Enum):
+    ASC = "asc"
+    DESC = "desc"
+
+class TaskSearchHit(BaseModel):
+    task: Task
+    # 命中位置用<mark></mark>标出的片段，文本未做HTML转义
+    text_snippet: str
+    description_snippet: Optional[str] = None
+
+class TaskSearchResults(BaseModel):
+    results: List[TaskSearchHit] = []
+    # 下一页的offset，没有更多结果时为空
+    next_offset: Optional[int] = None
+
+class TaskChanges(BaseModel):
+    cursor: int
+    reset: bool = False
+    tasks: List[Task] = []
+    deleted: List[int] = []
+
 class TaskCreate(TaskBase):
     pass
 
@@ -40,6 +67,71 @@ class TaskUpdate(BaseModel):
     tags: Optional[List[str]] = None
     description: Optional[str] = None
 
+class TagCount(BaseModel):
+    tag: str
+    count: int
+
+class BatchOperationType(str, Enum):
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+    RESTORE = "restore"
+
+class TaskBatchOperation(TaskUpdate):
+    """批量操作中的一项：create需要text和creator，其余操作需要task_id"""
+    op: BatchOperationType
+    task_id: Optional[int] = None
+    creator: Optional[str] = None
+    permanent: bool = False
+
+class TaskBatchRequest(BaseModel):
+    operations: List[TaskBatchOperation]
+
+class TaskBatchResult(BaseModel):
+    index: int
+    status: str  # ok / not_found / invalid
+    task_id: Optional[int] = None
+    task: Optional[Task] = None
+    error: Optional[str] = None
+
+class TaskBatchResponse(BaseModel):
+    results: List[TaskBatchResult]
+
+class TransferFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+class TaskImport(BaseModel):
+    """导入文件中的一行任务；id和room_id会被忽略，任务导入到请求指定的房间"""
+    text: str
+    creator: str
+    completed: bool = False
+    priority: Priority = Priority.MEDIUM
+    due_date: Optional[datetime] = None
+    tags: List[str] = []
+    description: Optional[str] = None
+    is_deleted: bool = False
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    deleted_at: Optional[datetime] = None
+
+class TaskCommandAction(str, Enum):
+    CREATE = "create"
+    UPDATE = "update"
+    TOGGLE = "toggle"
+    DELETE = "delete"
+    RESTORE = "restore"
+
+class TaskCommand(TaskUpdate):
+    """WebSocket上的任务命令：create需要text，其余操作需要task_id
+
+    房间和创建者取自WebSocket连接；request_id由客户端生成，原样出现在确认消息中。
+    """
+    request_id: str
+    action: TaskCommandAction
+    task_id: Optional[int] = None
+    permanent: bool = False
+
 class RoomBase(BaseModel):
     token: str
 
@@ -52,4 +144,9 @@ class Room(RoomBase):
         orm_mode = True
 
 class RoomCreate(RoomBase):
-    pass
\ No newline at end of file
+    pass
+
+def construct(model_cls, **values):
+    """跳过校验直接构造模型，只用于数据库中读出的可信数据（兼容pydantic v1/v2）"""
+    build = getattr(model_cls, "model_construct", None) or model_cls.construct
+    return build(**values)
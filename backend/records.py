@@ -0,0 +1,77 @@
+"""
+任务的内部表示
+
+数据库里的任务行是我们自己写入的，字段类型已知，不需要再走pydantic校验。
+TaskRecord 用 __slots__ 保存一行任务，时间字段保持数据库中的ISO字符串——
+它和JSON输出的格式相同，列表接口可以直接从记录编码响应，不用解析和重新格式化时间。
+"""
+
+import json
+from typing import Any, Dict
+
+TASK_FIELDS = (
+    "id", "text", "completed", "creator", "room_id", "priority", "due_date",
+    "tags", "description", "is_deleted", "created_at", "updated_at", "deleted_at",
+)
+
+
+class TaskRecord:
+    # seq：产生这条记录的写操作之后房间的事件序号，只有写操作返回的记录才有，不输出到JSON
+    __slots__ = TASK_FIELDS + ("seq",)
+
+    def __init__(self, id, text, completed, creator, room_id, priority, due_date,
+                 tags, description, is_deleted, created_at, updated_at, deleted_at, seq=None):
+        self.id = id
+        self.text = text
+        self.completed = completed
+        self.creator = creator
+        self.room_id = room_id
+        self.priority = priority
+        self.due_date = due_date
+        self.tags = tags
+        self.description = description
+        self.is_deleted = is_deleted
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.deleted_at = deleted_at
+        self.seq = seq
+
+    @classmethod
+    def from_row(cls, row) -> "TaskRecord":
+        """从 SELECT * / RETURNING * 的结果行解码，所有读取路径共用"""
+        tags = row['tags']
+        return cls(
+            row['id'],
+            row['text'],
+            bool(row['completed']),
+            row['creator'],
+            row['room_id'],
+            row['priority'] or 'medium',
+            row['due_date'],
+            json.loads(tags) if tags and tags != '[]' else [],
+            row['description'],
+            bool(row['is_deleted']),
+            row['created_at'],
+            row['updated_at'],
+            row['deleted_at'],
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "text": self.text,
+            "completed": self.completed,
+            "creator": self.creator,
+            "room_id": self.room_id,
+            "priority": self.priority,
+            "due_date": self.due_date,
+            "tags": self.tags,
+            "description": self.description,
+            "is_deleted": self.is_deleted,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "deleted_at": self.deleted_at,
+        }
+
+    def __repr__(self) -> str:
+        return f"TaskRecord(id={self.id!r}, room_id={self.room_id!r}, text={self.text!r})"
@@ -0,0 +1,54 @@
+"""
+JSON编码：优先使用orjson，未安装时退回标准库json
+
+WebSocket广播和REST响应共用这里的编码，保证输出格式一致。
+"""
+
+import json
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from records import TaskRecord
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson是可选依赖
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, TaskRecord):
+        return obj.to_dict()
+    if isinstance(obj, BaseModel):
+        # 只展开一层，嵌套的模型和TaskRecord再回到这里；datetime等字段交给编码器本身处理
+        return dict(obj)
+    return jsonable_encoder(obj)
+
+
+def encode_json(obj: Any) -> str:
+    """把对象编码为JSON文本，可直接作为WebSocket文本帧发送"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default).decode()
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_json_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return encode_json(obj).encode("utf-8")
+
+
+def decode_json(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """使用encode_json_bytes渲染的JSON响应，作为应用的默认响应类"""
+
+    def render(self, content: Any) -> bytes:
+        return encode_json_bytes(content)
@@ -0,0 +1,181 @@
+"""
+房间分片
+
+所有房间共用一个SQLite文件时，一个房间的写入高峰会因为全局写锁拖慢所有房间。
+开启分片后（DATABASE_SHARDS > 1），房间按token一致性哈希到N个数据库文件，
+每个分片有自己的连接池、写连接和写队列，多个分片的写入可以并行。
+
+- 分片0就是 DATABASE_URL 本身，分片i是同目录下的 todo.shard{i}.db，
+  DATABASE_SHARDS=1（默认）时和不分片完全一样。
+- 一个房间的所有数据（房间、任务、标签、全文索引、版本号、归档、在线状态）都在它所在的分片。
+- 分片i的任务id和房间id都从 i << SHARD_ID_BITS 开始分配，不同分片的id不会重复；
+  只有task_id的接口可以直接从id算出分片。
+- 调整分片数量后需要停机执行 python init_db.py --rebalance，把不再属于原分片的房间迁到新分片；
+  一致性哈希保证只有约 1/N 的房间需要移动。
+"""
+
+import os
+import bisect
+import hashlib
+import sqlite3
+from typing import Dict, List, Set
+
+from migrations import migrate
+
+DATABASE_SHARDS = max(1, int(os.getenv("DATABASE_SHARDS", "1")))
+# 每个分片在哈希环上的虚拟节点数，越多分布越均匀；修改后需要重新平衡
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "64"))
+# 任务和房间id的低40位是分片内的序号，高位是分片编号（保持在JavaScript安全整数范围内）
+SHARD_ID_BITS = 40
+
+
+def shard_path(base: str, index: int) -> str:
+    """分片的数据库文件路径；分片0沿用原来的文件，已有数据不需要迁移"""
+    if index == 0:
+        return base
+    root, ext = os.path.splitext(base)
+    return f"{root}.shard{index}{ext or '.db'}"
+
+
+def shard_id_base(index: int) -> int:
+    return index << SHARD_ID_BITS
+
+
+def task_shard_index(task_id: int) -> int:
+    return task_id >> SHARD_ID_BITS
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ShardRing:
+    """一致性哈希环：增加一个分片只会让原来各分片中的一部分房间移到新分片"""
+
+    def __init__(self, count: int = DATABASE_SHARDS, virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        self.count = max(1, count)
+        points = sorted(
+            (_hash(f"shard-{index}#{node}"), index)
+            for index in range(self.count)
+            for node in range(max(1, virtual_nodes))
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [index for _, index in points]
+
+    def shard_for(self, room_id: str) -> int:
+        if self.count == 1:
+            return 0
+        position = bisect.bisect(self._hashes, _hash(room_id)) % len(self._hashes)
+        return self._shards[position]
+
+
+def migrate_shards(base: str, count: int = DATABASE_SHARDS) -> List[int]:
+    """把所有分片升级到最新结构，返回各分片的版本号"""
+    return [migrate(shard_path(base, index), shard_id_base(index)) for index in range(count)]
+
+
+# 迁移房间时原样复制的任务字段（id由目标分片重新分配，rev由触发器生成）
+_TASK_COPY_COLUMNS = (
+    "text, completed, creator, room_id, priority, due_date, tags, description, "
+    "is_deleted, created_at, updated_at, deleted_at"
+)
+
+
+def _room_ids(conn: sqlite3.Connection, schema: str) -> Set[str]:
+    rows = conn.execute(
+        f"""SELECT token FROM {schema}.rooms
+            UNION SELECT room_id FROM {schema}.tasks
+            UNION SELECT room_id FROM {schema}.tasks_archive"""
+    )
+    return {row[0] for row in rows}
+
+
+def _move_room(conn: sqlite3.Connection, room_id: str) -> int:
+    """把房间从附加的src分片移到main分片，返回移动的任务数
+
+    任务和房间在目标分片中获得新的id（落在目标分片的id区间内）；房间事件序号继续增长，
+    断线续传的客户端会收到全量快照。目标分片中该房间的残留数据（上次中断的迁移）会先被清除。
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM main.tasks WHERE room_id = ?", (room_id,))
+        conn.execute("DELETE FROM main.tasks_archive WHERE room_id = ?", (room_id,))
+        conn.execute("DELETE FROM main.room_revs WHERE room_id = ?", (room_id,))
+        conn.execute("DELETE FROM main.task_tombstones WHERE room_id = ?", (room_id,))
+        row = conn.execute("SELECT seq FROM src.room_revs WHERE room_id = ?", (room_id,)).fetchone()
+        old_seq = row[0] if row else 0
+
+        conn.execute(
+            """INSERT OR IGNORE INTO main.rooms (token, created_at)
+               SELECT token, created_at FROM src.rooms WHERE token = ?""",
+            (room_id,)
+        )
+        moved = conn.execute(
+            f"""INSERT INTO main.tasks ({_TASK_COPY_COLUMNS})
+                SELECT {_TASK_COPY_COLUMNS} FROM src.tasks WHERE room_id = ? ORDER BY id""",
+            (room_id,)
+        ).rowcount
+        conn.execute(
+            "INSERT OR REPLACE INTO main.tasks_archive SELECT * FROM src.tasks_archive WHERE room_id = ?",
+            (room_id,)
+        )
+        if old_seq:
+            conn.execute(
+                """INSERT INTO main.room_revs (room_id, rev, seq)
+                   VALUES (?, (SELECT rev FROM main.sync_state), ? + 1)
+                   ON CONFLICT (room_id) DO UPDATE SET seq = seq + ?""",
+                (room_id, old_seq, old_seq)
+            )
+
+        # 客户端手里的增量同步版本号来自原分片，在目标分片里没有意义：
+        # 把版本号推到两个分片都没用过的值并设为墓碑下限，之前的版本号都会得到全量快照
+        conn.execute(
+            """UPDATE main.sync_state
+               SET rev = MAX(rev, (SELECT rev FROM src.sync_state)) + 1,
+                   tombstone_floor = MAX(rev, (SELECT rev FROM src.sync_state)) + 1"""
+        )
+
+        conn.execute("DELETE FROM src.tasks WHERE room_id = ?", (room_id,))
+        conn.execute("DELETE FROM src.tasks_archive WHERE room_id = ?", (room_id,))
+        conn.execute("DELETE FROM src.rooms WHERE token = ?", (room_id,))
+        conn.execute("DELETE FROM src.room_revs WHERE room_id = ?", (room_id,))
+        conn.execute("DELETE FROM src.task_tombstones WHERE room_id = ?", (room_id,))
+        conn.execute("DELETE FROM src.room_presence WHERE room_id = ?", (room_id,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return moved
+
+
+def rebalance(base: str, count: int = DATABASE_SHARDS, from_count: int = DATABASE_SHARDS) -> Dict[str, int]:
+    """按当前分片数重新分配房间，需要停机执行；中断后可以重复执行
+
+    from_count 是调整前的分片数，减少分片时需要传入，编号超出count的分片会被清空。
+    """
+    ring = ShardRing(count)
+    migrate_shards(base, max(count, from_count))
+    stats = {"rooms": 0, "tasks": 0}
+    for source in range(max(count, from_count)):
+        source_path = shard_path(base, source)
+        plan: Dict[int, List[str]] = {}
+        conn = sqlite3.connect(source_path)
+        try:
+            for room_id in _room_ids(conn, "main"):
+                target = ring.shard_for(room_id)
+                if target != source:
+                    plan.setdefault(target, []).append(room_id)
+        finally:
+            conn.close()
+
+        for target, room_ids in sorted(plan.items()):
+            conn = sqlite3.connect(shard_path(base, target), isolation_level=None)
+            try:
+                conn.execute("ATTACH DATABASE ? AS src", (source_path,))
+                for room_id in sorted(room_ids):
+                    stats["tasks"] += _move_room(conn, room_id)
+                    stats["rooms"] += 1
+            finally:
+                conn.close()
+            print(f"分片 {source} -> {target}: 移动了 {len(room_ids)} 个房间")
+    return stats
@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 配置在模块导入时读取，必须在导入后端模块之前指向临时数据库
+os.environ["DATABASE_URL"] = os.path.join(tempfile.mkdtemp(), "test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture
+def make_room(client):
+    def factory() -> str:
+        return client.post("/rooms/create").json()["token"]
+    return factory
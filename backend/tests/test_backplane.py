@@ -0,0 +1,55 @@
+import asyncio
+import os
+import tempfile
+
+from backplane import UnixSocketBackplane
+
+
+async def _wait_for(predicate, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "等待超时"
+        await asyncio.sleep(0.01)
+
+
+async def _pair():
+    path = os.path.join(tempfile.mkdtemp(), "bp.sock")
+    received = []
+    sender, receiver = UnixSocketBackplane(path), UnixSocketBackplane(path)
+    await sender.start(lambda *args: None)
+    await receiver.start(lambda *args: received.append(args))
+    await _wait_for(lambda: sender._writer is not None and receiver._writer is not None)
+    return sender, receiver, received
+
+
+def test_room_id_with_separators_is_not_split():
+    async def scenario():
+        sender, receiver, received = await _pair()
+        try:
+            room_id = 'evil\t\t2:3\t{"x":2}\nroom\tx\t\t{}'
+            await sender.publish(room_id, '{"type":"chat"}', "task:1", (1, 2))
+            await _wait_for(lambda: received)
+            await asyncio.sleep(0.05)
+            assert received == [(room_id, '{"type":"chat"}', "task:1", (1, 2))]
+        finally:
+            await sender.stop()
+            await receiver.stop()
+
+    asyncio.run(scenario())
+
+
+def test_malformed_line_does_not_drop_connection():
+    async def scenario():
+        sender, receiver, received = await _pair()
+        try:
+            writer = receiver._writer
+            sender._writer.write(b"room\tkey\t\t{}\n[1,2]\n{\"room\": 1}\n")
+            await sender.publish("room", "{}")
+            await _wait_for(lambda: received)
+            assert received == [("room", "{}", None, None)]
+            assert receiver._writer is writer
+        finally:
+            await sender.stop()
+            await receiver.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,21 @@
+from cache import RoomCache
+
+
+def test_entry_keeps_only_encoded_body():
+    cache = RoomCache(max_bytes=1_000)
+    entry = cache.put("room", "tasks", 1, [{"id": 1, "text": "x"}])
+
+    assert not hasattr(entry, "tasks")
+    assert entry.size == len(entry.body)
+    assert cache.bytes == entry.size
+    assert cache.get("room", "tasks", 1) is entry
+
+
+def test_budget_counts_body_bytes():
+    cache = RoomCache(max_bytes=100)
+    for i in range(10):
+        cache.put(f"room{i}", "tasks", 1, [{"text": "x" * 20}])
+
+    assert cache.bytes <= 100
+    assert cache.get("room9", "tasks", 1) is not None
+    assert cache.get("room0", "tasks", 1) is None
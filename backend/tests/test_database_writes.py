@@ -0,0 +1,24 @@
+import sqlite3
+
+import pytest
+
+from database import Database, room_shard
+
+
+def test_write_holds_lock_before_first_statement(client, make_room):
+    room = make_room()
+    shard = room_shard(room)
+
+    async def op(db):
+        # 还没有执行任何写语句，其他进程的写连接已经拿不到写锁
+        other = sqlite3.connect(shard.path, timeout=0, isolation_level=None)
+        try:
+            with pytest.raises(sqlite3.OperationalError):
+                other.execute("BEGIN IMMEDIATE")
+        finally:
+            other.close()
+        return db.in_transaction
+
+    if shard.write_queue.is_running:
+        pytest.skip("组提交模式由写队列开启事务")
+    assert client.portal.call(Database._write, shard, op) is True
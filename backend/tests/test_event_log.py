@@ -0,0 +1,43 @@
+from event_log import RoomEventLog
+
+
+def _fill(log, room_id, count, size):
+    for seq in range(1, count + 1):
+        log.append(room_id, seq - 1, seq, "x" * size)
+
+
+def test_room_byte_budget_drops_oldest_events():
+    log = RoomEventLog(size=100, room_bytes=250, max_bytes=10_000)
+    _fill(log, "a", 5, 100)
+
+    assert log.stats() == {"rooms": 1, "events": 2, "bytes": 200}
+    assert log.replay("a", 3, 5) == ["x" * 100, "x" * 100]
+    # 被丢弃的事件接不上，调用方退回全量快照
+    assert log.replay("a", 1, 5) is None
+
+
+def test_total_byte_budget_evicts_least_recent_room():
+    log = RoomEventLog(size=100, room_bytes=1_000, max_bytes=500)
+    _fill(log, "a", 3, 100)
+    _fill(log, "b", 3, 100)
+
+    assert log.stats() == {"rooms": 1, "events": 3, "bytes": 300}
+    assert log.replay("a", 0, 3) is None
+    assert log.replay("b", 0, 3) == ["x" * 100] * 3
+
+
+def test_oversized_event_is_not_kept():
+    log = RoomEventLog(size=100, room_bytes=150, max_bytes=10_000)
+    _fill(log, "a", 2, 50)
+    log.append("a", 2, 3, "x" * 200)
+
+    assert log.stats() == {"rooms": 0, "events": 0, "bytes": 0}
+    assert log.replay("a", 2, 3) is None
+
+
+def test_event_count_limit_still_applies():
+    log = RoomEventLog(size=3)
+    _fill(log, "a", 5, 10)
+
+    assert log.stats() == {"rooms": 1, "events": 3, "bytes": 30}
+    assert log.replay("a", 2, 5) == ["x" * 10] * 3
@@ -0,0 +1,41 @@
+from urllib.parse import quote
+
+from database import Database
+from transfer import ImportRegistry
+
+
+def test_import_progress_is_shared_through_database(client, make_room):
+    room = make_room()
+    body = '{"text": "a", "creator": "u"}\n{"text": "b"}\n'
+    r = client.post(f"/rooms/{room}/import", params={"job_id": "shared-job"}, content=body)
+    assert r.status_code == 200
+    assert r.json()["status"] == "done"
+
+    # 另一个worker的registry没有这个导入的内存状态，只能从数据库读到
+    job = client.portal.call(ImportRegistry().get, "shared-job")
+    assert job["room_id"] == room
+    assert (job["status"], job["rows"], job["imported"], job["failed"]) == ("done", 2, 1, 1)
+    assert job["errors"][0]["row"] == 2
+
+    progress = client.get("/imports/shared-job").json()
+    assert progress["imported"] == 1 and progress["finished_at"]
+
+
+def test_unknown_import_job(client):
+    assert client.get("/imports/missing").status_code == 404
+
+
+def test_export_unknown_room_is_404(client):
+    assert client.get("/rooms/missing/export").status_code == 404
+    assert client.get("/rooms/中文/export").status_code == 404
+
+
+def test_export_filename_is_escaped(client):
+    for room in ("中文", 'a"b'):
+        client.portal.call(Database.create_room, room)
+        r = client.get(f"/rooms/{room}/export", params={"format": "csv"})
+        assert r.status_code == 200
+        disposition = r.headers["content-disposition"]
+        assert disposition.isascii()
+        assert disposition.count('"') == 2
+        assert disposition.endswith("filename*=UTF-8''" + quote(f"{room}.csv", safe=""))
@@ -0,0 +1,11 @@
+def test_metrics_do_not_expose_room_tokens(client, make_room):
+    room = make_room()
+    client.post("/tasks", json={"text": "x", "creator": "a", "room_id": room})
+
+    with client.websocket_connect(f"/ws/{room}/a") as ws:
+        ws.receive_text()
+        text = client.get("/metrics").text
+
+    assert room not in text
+    assert "todo_ws_connections 1" in text
+    assert "todo_ws_rooms 1" in text
@@ -0,0 +1,58 @@
+import sqlite3
+
+from migrations import migrate
+from sharding import shard_id_base, task_shard_index
+
+
+def _insert(path, statements):
+    conn = sqlite3.connect(path)
+    try:
+        ids = [conn.execute(sql, params).lastrowid for sql, params in statements]
+        conn.commit()
+        return ids
+    finally:
+        conn.close()
+
+
+def _new_room(token):
+    return "INSERT INTO rooms (token, created_at) VALUES (?, '2026-01-01T00:00:00')", (token,)
+
+
+def _new_task(room_id):
+    return "INSERT INTO tasks (text, creator, room_id, created_at) VALUES ('t', 'u', ?, '2026-01-01T00:00:00')", (room_id,)
+
+
+def test_room_and_task_ids_use_shard_range(tmp_path):
+    paths = [str(tmp_path / f"shard{i}.db") for i in range(3)]
+    for index, path in enumerate(paths):
+        migrate(path, shard_id_base(index))
+
+    room_ids, task_ids = [], []
+    for index, path in enumerate(paths):
+        room_id, task_id = _insert(path, [_new_room(f"room{index}"), _new_task(f"room{index}")])
+        room_ids.append(room_id)
+        task_ids.append(task_id)
+
+    assert len(set(room_ids)) == 3
+    assert [task_shard_index(room_id) for room_id in room_ids] == [0, 1, 2]
+    assert [task_shard_index(task_id) for task_id in task_ids] == [0, 1, 2]
+
+
+def test_existing_room_ids_move_into_shard_range(tmp_path):
+    path = str(tmp_path / "shard1.db")
+    migrate(path)
+    old_ids = _insert(path, [_new_room("a"), _new_room("b")])
+    assert old_ids == [1, 2]
+
+    base = shard_id_base(1)
+    migrate(path, base)
+    migrate(path, base)
+    (new_id,) = _insert(path, [_new_room("c")])
+
+    conn = sqlite3.connect(path)
+    try:
+        ids = [row[0] for row in conn.execute("SELECT id FROM rooms ORDER BY token")]
+    finally:
+        conn.close()
+    assert ids == [base + 1, base + 2, base + 3]
+    assert new_id == base + 3
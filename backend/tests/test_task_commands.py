@@ -0,0 +1,38 @@
+def _command(ws, **payload):
+    ws.send_json({"type": "command", "request_id": "r1", **payload})
+    while True:
+        message = ws.receive_json()
+        if message.get("type") == "ack":
+            return message
+
+
+def test_command_cannot_touch_task_in_another_room(client, make_room):
+    room_a, room_b = make_room(), make_room()
+    task = client.post("/tasks", json={"text": "b的任务", "creator": "b", "room_id": room_b}).json()
+
+    with client.websocket_connect(f"/ws/{room_a}/a") as ws:
+        for action, extra in (
+            ("update", {"text": "改掉"}),
+            ("toggle", {}),
+            ("delete", {"permanent": True}),
+            ("restore", {}),
+        ):
+            ack = _command(ws, action=action, task_id=task["id"], **extra)
+            assert ack["status"] == "not_found", action
+            assert "task" not in ack
+
+    tasks = client.get(f"/rooms/{room_b}/tasks").json()
+    assert [(t["id"], t["text"], t["completed"], t["is_deleted"]) for t in tasks] == [
+        (task["id"], "b的任务", False, False)
+    ]
+
+
+def test_command_updates_task_in_own_room(client, make_room):
+    room = make_room()
+    task = client.post("/tasks", json={"text": "x", "creator": "a", "room_id": room}).json()
+
+    with client.websocket_connect(f"/ws/{room}/a") as ws:
+        ack = _command(ws, action="toggle", task_id=task["id"])
+
+    assert ack["status"] == "ok"
+    assert ack["task"]["completed"] is True
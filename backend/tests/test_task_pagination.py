@@ -0,0 +1,72 @@
+import base64
+import sqlite3
+
+import pytest
+
+from database import _SORT_SQL, _keyset_condition
+from migrations import migrate
+from models import TaskSort
+
+
+@pytest.mark.parametrize("sort", list(TaskSort))
+@pytest.mark.parametrize("descending", [True, False])
+def test_cursor_page_seeks_sort_index(tmp_path, sort, descending):
+    path = str(tmp_path / "plan.db")
+    migrate(path)
+    sort_sql, _ = _SORT_SQL[sort]
+    direction = "DESC" if descending else "ASC"
+    query = (
+        f"SELECT * FROM tasks WHERE room_id = ? AND is_deleted = 0 AND {_keyset_condition(sort_sql, descending)} "
+        f"ORDER BY {sort_sql} {direction}, id {direction} LIMIT 20"
+    )
+    conn = sqlite3.connect(path)
+    try:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, ("room", 1, 1, 1))]
+    finally:
+        conn.close()
+    # 索引定位到游标位置，而不是从房间的第一行开始扫描
+    op = "<" if descending else ">"
+    assert len(plan) == 1 and plan[0].startswith("SEARCH tasks USING INDEX"), plan
+    assert f"{op}?)" in plan[0], plan
+
+
+@pytest.mark.parametrize("sort", ["priority", "due_date", "created_at", "updated_at"])
+def test_cursor_pages_cover_every_task_once(client, make_room, sort):
+    room = make_room()
+    for i in range(12):
+        client.post("/tasks", json={
+            "text": f"t{i}", "creator": "a", "room_id": room,
+            "priority": ["low", "medium", "high", "urgent"][i % 4],
+            "due_date": f"2026-01-{i % 3 + 1:02d}T00:00:00" if i % 2 else None,
+        })
+
+    seen, cursor = [], None
+    while True:
+        params = {"sort": sort, "limit": 5}
+        if cursor:
+            params["cursor"] = cursor
+        r = client.get(f"/rooms/{room}/tasks", params=params)
+        seen += [task["id"] for task in r.json()]
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor:
+            break
+
+    assert len(seen) == 12 and len(set(seen)) == 12
+    full = [task["id"] for task in client.get(f"/rooms/{room}/tasks", params={"sort": sort}).json()]
+    assert seen == full
+
+
+@pytest.mark.parametrize("payload", [
+    b"[{}, 1]",
+    b"[[1], 1]",
+    b'["2026-01-01", {}]',
+    b'["2026-01-01", "1"]',
+    b"[true, 1]",
+    b"[1]",
+    b"not json",
+])
+def test_malformed_cursor_is_rejected(client, make_room, payload):
+    room = make_room()
+    cursor = base64.urlsafe_b64encode(payload).decode("ascii")
+    r = client.get(f"/rooms/{room}/tasks", params={"cursor": cursor, "limit": 5})
+    assert r.status_code == 400
@@ -0,0 +1,50 @@
+import asyncio
+
+from websocket_manager import ClientConnection
+
+
+class FakeWebSocket:
+    def __init__(self, block: bool = False):
+        self.sent = []
+        self.closed_with = None
+        self._block = block
+
+    async def send_text(self, frame):
+        if self._block:
+            await asyncio.Event().wait()
+        self.sent.append(frame)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_close_waits_for_sender():
+    async def scenario():
+        connection = ClientConnection(FakeWebSocket(), "room", "a", on_dead=lambda c: None)
+        connection.enqueue('{"n":1}')
+        await asyncio.sleep(0)
+        await connection.close()
+        assert connection._sender.done()
+        await connection.close()
+
+    asyncio.run(scenario())
+
+
+def test_reaped_connection_is_fully_closed():
+    async def scenario():
+        dead = []
+        websocket = FakeWebSocket(block=True)
+        connection = ClientConnection(
+            websocket, "room", "a", on_dead=dead.append, max_queue=1, overflow_policy="disconnect"
+        )
+        connection.enqueue('{"n":1}')
+        await asyncio.sleep(0)
+        connection.enqueue('{"n":2}')
+        connection.enqueue('{"n":3}')
+        assert dead == [connection]
+        await connection.close()
+        assert connection._sender.done() and connection._closer.done()
+        assert websocket.closed_with == 1013
+        assert not [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    asyncio.run(scenario())
@@ -0,0 +1,230 @@
+"""
+房间任务的流式导出和批量导入
+
+导出按块从数据库读取并逐块编码发送（NDJSON每行一个任务，CSV第一行为表头），
+内存占用与房间大小无关。导入边接收请求体边解析，攒够一批后用一次executemany写入，
+每批写入后把进度保存到数据库，任何worker都可以通过 GET /imports/{job_id} 查询。
+"""
+
+import io
+import os
+import re
+import csv
+import json
+import secrets
+from urllib.parse import quote
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from database import Database
+from models import TaskImport, TransferFormat
+from records import TaskRecord, TASK_FIELDS
+from serialization import encode_json_bytes, decode_json
+
+# 导出时每次从数据库读取的任务数
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "500"))
+# 导入时每个事务写入的任务数
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# 导入文件中单条记录的最大字节数
+IMPORT_MAX_LINE = int(os.getenv("IMPORT_MAX_LINE", str(1024 * 1024)))
+# 进度中最多保留的错误条数，以及最多保留多少个导入任务的进度
+IMPORT_MAX_ERRORS = 20
+IMPORT_MAX_JOBS = 100
+
+EXPORT_MEDIA_TYPES = {
+    TransferFormat.NDJSON: "application/x-ndjson",
+    TransferFormat.CSV: "text/csv; charset=utf-8",
+}
+
+
+# 解析失败的行用这个键保存原文片段，由 validate_rows 记为错误
+INVALID_ROW = "_invalid"
+
+
+class ImportFormatError(ValueError):
+    """导入文件格式错误，整个导入终止"""
+
+
+async def ndjson_export(chunks: AsyncIterator[List[TaskRecord]]) -> AsyncIterator[bytes]:
+    async for tasks in chunks:
+        yield b"".join(encode_json_bytes(task) + b"\n" for task in tasks)
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "" if value is None else value
+
+
+async def csv_export(chunks: AsyncIterator[List[TaskRecord]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TASK_FIELDS)
+    async for tasks in chunks:
+        for task in tasks:
+            writer.writerow([_csv_value(getattr(task, field)) for field in TASK_FIELDS])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def _lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """把请求体切成行，跨块的行会被拼起来"""
+    pending = b""
+    async for chunk in stream:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        if len(pending) > IMPORT_MAX_LINE:
+            raise ImportFormatError(f"单条记录超过{IMPORT_MAX_LINE}字节")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8").rstrip("\r")
+
+
+async def ndjson_rows(stream: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    async for line in _lines(stream):
+        if not line.strip():
+            continue
+        try:
+            row = decode_json(line)
+        except ValueError:
+            row = None
+        # 无法解析的行记为错误，不终止导入
+        yield row if isinstance(row, dict) else {INVALID_ROW: line[:100]}
+
+
+def _csv_row(header: List[str], values: List[str]) -> Dict[str, Any]:
+    row: Dict[str, Any] = {}
+    for field, value in zip(header, values):
+        if value == "":
+            continue
+        row[field] = json.loads(value) if field == "tags" else value
+    return row
+
+
+async def csv_rows(stream: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """按行解析CSV；引号内的换行会让一条记录跨多行，引号成对出现时记录才结束"""
+    header: Optional[List[str]] = None
+    record = ""
+    async for line in _lines(stream):
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            if len(record) > IMPORT_MAX_LINE:
+                raise ImportFormatError(f"单条记录超过{IMPORT_MAX_LINE}字节")
+            continue
+        values = next(csv.reader([record]), [])
+        record = ""
+        if not values:
+            continue
+        if header is None:
+            header = values
+            continue
+        try:
+            yield _csv_row(header, values)
+        except ValueError:
+            yield {INVALID_ROW: ",".join(values)[:100]}
+    if record:
+        raise ImportFormatError("CSV引号未闭合")
+
+
+def export_disposition(room_id: str, fmt: TransferFormat) -> str:
+    """导出文件的Content-Disposition
+
+    room_id来自URL，可能包含引号或非ASCII字符：filename只保留安全的ASCII字符，
+    完整的文件名按RFC 5987放在 filename* 中。
+    """
+    filename = f"{room_id}.{fmt.value}"
+    fallback = re.sub(r"[^A-Za-z0-9._-]", "_", filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def export_tasks(fmt: TransferFormat, chunks: AsyncIterator[List[TaskRecord]]) -> AsyncIterator[bytes]:
+    return csv_export(chunks) if fmt == TransferFormat.CSV else ndjson_export(chunks)
+
+
+def parse_rows(fmt: TransferFormat, stream: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    return csv_rows(stream) if fmt == TransferFormat.CSV else ndjson_rows(stream)
+
+
+def validate_rows(rows: List[Tuple[int, Dict[str, Any]]]) -> Tuple[List[TaskImport], List[Dict[str, Any]]]:
+    """校验一批记录，返回合法的任务和错误（带记录序号）"""
+    items = []
+    errors = []
+    for index, row in rows:
+        if INVALID_ROW in row:
+            errors.append({"row": index, "error": f"无法解析: {row[INVALID_ROW]}"})
+            continue
+        try:
+            items.append(TaskImport(**row))
+        except ValidationError as e:
+            error = e.errors()[0]
+            field = ".".join(str(part) for part in error["loc"])
+            errors.append({"row": index, "error": f"{field}: {error['msg']}"})
+    return items, errors
+
+
+class ImportJob:
+    def __init__(self, job_id: str, room_id: str, fmt: TransferFormat):
+        self.job_id = job_id
+        self.room_id = room_id
+        self.format = fmt.value
+        self.status = "running"
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.batches = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.started_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+
+    def add_errors(self, errors: List[Dict[str, Any]]):
+        self.failed += len(errors)
+        room = IMPORT_MAX_ERRORS - len(self.errors)
+        if room > 0:
+            self.errors.extend(errors[:room])
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.finished_at = datetime.utcnow()
+        if error:
+            self.errors.append({"row": None, "error": error})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "room_id": self.room_id,
+            "format": self.format,
+            "status": self.status,
+            "rows": self.rows,
+            "imported": self.imported,
+            "failed": self.failed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ImportRegistry:
+    """最近的导入任务进度，保存在数据库中，多worker部署时任何进程都能查询"""
+
+    def __init__(self, max_jobs: int = IMPORT_MAX_JOBS):
+        self.max_jobs = max_jobs
+
+    async def create(self, room_id: str, fmt: TransferFormat, job_id: Optional[str] = None) -> ImportJob:
+        job = ImportJob(job_id or secrets.token_urlsafe(8), room_id, fmt)
+        await self.save(job)
+        return job
+
+    async def save(self, job: ImportJob):
+        await Database.save_import_job(job.to_dict(), self.max_jobs)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await Database.get_import_job(job_id)
@@ -1,29 +1,312 @@
+import os
+import time
+import socket
+import asyncio
+from collections import deque
 from fastapi import WebSocket
-from typing import Dict, Set, Any
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+from serialization import encode_json
+from backplane import BACKPLANE, Backplane, EventSeq, create_backplane
+from event_log import RoomEventLog
+import metrics
+
+# 每个连接的发送队列长度
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+# 队列满时的处理策略：drop_oldest 丢弃最早的消息；coalesce 合并同一任务的待发送消息；
+# disconnect 断开连接（客户端重连后重新拉取）
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+# 单条消息的发送超时（秒），超时视为死连接
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# 连接在这段时间（秒）内没有收到任何消息（包括心跳ping）就断开，0表示不限制
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "120"))
+# 在线状态快照写入数据库的间隔（秒），供其他worker查询；0表示不写。
+# 单进程部署时本进程的内存状态就是完整的，默认不写
+PRESENCE_SNAPSHOT_INTERVAL = float(
+    os.getenv("PRESENCE_SNAPSHOT_INTERVAL", "0" if BACKPLANE == "local" else "5")
+)
+# 当前进程在在线状态快照中的标识
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def coalesce_key(message: Any) -> Optional[str]:
+    """同一个任务的多条待发送消息可以只保留最新一条"""
+    if not isinstance(message, dict):
+        return None
+    task = message.get("task")
+    if task is None:
+        task_id = message.get("task_id")
+    else:
+        task_id = task.get("id") if isinstance(task, dict) else getattr(task, "id", None)
+    return None if task_id is None else str(task_id)
+
+
+class ClientConnection:
+    """单个WebSocket连接：有界发送队列 + 独立的发送协程
+
+    慢客户端只会堆积自己的队列，不会拖慢房间内其他成员和触发广播的请求。
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        room_id: str,
+        user_name: str,
+        on_dead: Callable[["ClientConnection"], None],
+        max_queue: int = WS_QUEUE_SIZE,
+        overflow_policy: str = WS_OVERFLOW_POLICY,
+        paused: bool = False,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的队列溢出策略: {overflow_policy}")
+        self.websocket = websocket
+        self.room_id = room_id
+        self.user_name = user_name
+        self.max_queue = max(1, max_queue)
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self.last_seen = time.monotonic()
+        # 是否已从在线计数中扣除
+        self.released = False
+        self._on_dead = on_dead
+        # (合并用的key, 消息, 入队时间)
+        self._pending: Deque[Tuple[Optional[str], str, float]] = deque()
+        self._wakeup = asyncio.Event()
+        # 暂停期间消息照常入队但不发送，resume时先发补发的消息
+        self._resumed = asyncio.Event()
+        if not paused:
+            self._resumed.set()
+        self._closed = False
+        self._sender = asyncio.create_task(self._send_loop())
+        # 被服务端断开时负责停止发送协程并关闭socket的任务
+        self._closer: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def touch(self):
+        """收到客户端消息（包括心跳）时调用"""
+        self.last_seen = time.monotonic()
+
+    def enqueue(self, frame: str, key: Optional[str] = None):
+        """放入一条已编码的消息；key相同的消息在coalesce策略下可以合并"""
+        if self._closed:
+            return
+        item = (key, frame, time.monotonic())
+        if len(self._pending) >= self.max_queue:
+            if self.overflow_policy == "disconnect":
+                self._reap()
+                return
+            if not (self.overflow_policy == "coalesce" and self._replace_pending(item)):
+                self._pending.popleft()
+                self._pending.append(item)
+            self.dropped += 1
+            metrics.WS_DROPPED_FRAMES.inc(self.overflow_policy)
+        else:
+            self._pending.append(item)
+        self._wakeup.set()
+
+    def _replace_pending(self, item: Tuple[Optional[str], str, float]) -> bool:
+        key = item[0]
+        if key is None:
+            return False
+        for index, (pending_key, _, _) in enumerate(self._pending):
+            if pending_key == key:
+                # 删除旧消息，新消息排到队尾以保证同一任务的顺序
+                del self._pending[index]
+                self._pending.append(item)
+                return True
+        return False
+
+    def resume(self, frames: List[str]):
+        """把frames排到队首并开始发送"""
+        if self._closed:
+            return
+        now = time.monotonic()
+        self._pending.extendleft((None, frame, now) for frame in reversed(frames))
+        self._resumed.set()
+        self._wakeup.set()
+
+    async def _send_loop(self):
+        try:
+            await self._resumed.wait()
+            # 除了取消之外也检查_closed：3.11的wait_for在发送恰好完成时可能吞掉取消
+            while not self._closed:
+                if not self._pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                _, frame, enqueued_at = self._pending.popleft()
+                await asyncio.wait_for(self.websocket.send_text(frame), WS_SEND_TIMEOUT)
+                metrics.WS_SEND_SECONDS.observe(time.monotonic() - enqueued_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 发送失败或超时：连接已失效
+            self._reap()
+
+    def _reap(self, code: int = 1013):
+        """服务端主动断开：可能在发送协程或同步的广播路径中调用，收尾交给单独的任务"""
+        if self._closed:
+            return
+        metrics.WS_REAPED.inc(str(code))
+        self._closed = True
+        self._pending.clear()
+        self._on_dead(self)
+        self._closer = asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        await self.close()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def close(self):
+        """停止发送协程并等待其退出，丢弃未发送的消息"""
+        self._closed = True
+        self._pending.clear()
+        self._resumed.set()
+        self._wakeup.set()
+        if self._sender is not asyncio.current_task():
+            self._sender.cancel()
+            try:
+                await self._sender
+            except asyncio.CancelledError:
+                pass
+        closer = self._closer
+        if closer is not None and closer is not asyncio.current_task():
+            try:
+                await closer
+            except asyncio.CancelledError:
+                pass
+
 
 class ConnectionManager:
-    def __init__(self):
-        # 存储每个房间的WebSocket连接
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
+    """本进程的WebSocket连接和房间在线状态
+
+    在线状态只保存在内存里：同一用户可以从多个设备连接，按连接数计数，
+    最后一个连接断开时才算离开。多worker部署时由 presence_snapshot 定期
+    把本进程的在线用户写入数据库，供其他worker合并。
+    """
+
+    def __init__(self, backplane: Optional[Backplane] = None, idle_timeout: float = WS_IDLE_TIMEOUT):
+        # 存储每个房间的WebSocket连接（仅本进程）
+        self.active_connections: Dict[str, Set[ClientConnection]] = {}
+        # 房间 -> 用户 -> 本进程中该用户的连接数
+        self.presence: Dict[str, Dict[str, int]] = {}
+        # 在线用户有变化、还没写入快照的房间
+        self.dirty_rooms: Set[str] = set()
+        # 最近的任务事件，用于断线续传
+        self.event_log = RoomEventLog()
+        self.idle_timeout = idle_timeout
+        # 多worker部署时通过backplane把事件转发给其他进程
+        self.backplane = backplane or create_backplane()
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def start(self):
+        # 其他worker发布的事件只需要投递给本进程的连接
+        await self.backplane.start(self._deliver_local)
+        if self.idle_timeout > 0:
+            self._sweeper = asyncio.create_task(self._sweep_idle())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        await self.backplane.stop()
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                await connection.close()
+        self.active_connections.clear()
+
+    async def connect(
+        self, websocket: WebSocket, room_id: str, user_name: str, paused: bool = False
+    ) -> Tuple[ClientConnection, bool]:
+        """接受连接；返回连接对象，以及这是否是该用户在本进程的第一个连接
 
-    async def connect(self, websocket: WebSocket, room_id: str, user_name: str):
+        paused=True 时连接先接收广播但不发送，等调用方准备好补发的消息后 resume。
+        """
         await websocket.accept()
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = {}
-        self.active_connections[room_id][user_name] = websocket
+        connection = ClientConnection(websocket, room_id, user_name, on_dead=self._remove, paused=paused)
+        self.active_connections.setdefault(room_id, set()).add(connection)
+        users = self.presence.setdefault(room_id, {})
+        users[user_name] = users.get(user_name, 0) + 1
+        joined = users[user_name] == 1
+        if joined:
+            self.dirty_rooms.add(room_id)
+        return connection, joined
 
-    def disconnect(self, room_id: str, user_name: str):
-        if room_id in self.active_connections:
-            self.active_connections[room_id].pop(user_name, None)
-            if not self.active_connections[room_id]:
-                del self.active_connections[room_id]
+    async def disconnect(self, connection: ClientConnection) -> bool:
+        """连接结束时调用（可重复调用）；返回该用户是否已没有其他连接"""
+        await connection.close()
+        self._remove(connection)
+        if connection.released:
+            return False
+        connection.released = True
+        users = self.presence.get(connection.room_id, {})
+        count = users.get(connection.user_name, 0) - 1
+        if count > 0:
+            users[connection.user_name] = count
+            return False
+        users.pop(connection.user_name, None)
+        if not users:
+            self.presence.pop(connection.room_id, None)
+        self.dirty_rooms.add(connection.room_id)
+        return True
+
+    def _remove(self, connection: ClientConnection):
+        """从广播列表中移除；在线计数由disconnect负责"""
+        connections = self.active_connections.get(connection.room_id)
+        if connections and connection in connections:
+            connections.discard(connection)
+            if not connections:
+                del self.active_connections[connection.room_id]
+
+    async def _sweep_idle(self):
+        """定期断开超过idle_timeout没有收到消息的连接"""
+        interval = max(1.0, self.idle_timeout / 4)
+        while True:
+            await asyncio.sleep(interval)
+            deadline = time.monotonic() - self.idle_timeout
+            for connections in list(self.active_connections.values()):
+                for connection in list(connections):
+                    if connection.last_seen < deadline:
+                        # 关闭后接收协程会收到断开并走正常的离开流程
+                        connection._reap(code=1001)
+
+    async def broadcast_to_room(self, room_id: str, message: Any, seq: EventSeq = None):
+        """把消息放入房间内每个连接的发送队列，不等待实际发送
 
-    async def broadcast_to_room(self, room_id: str, message: Any):
+        消息只编码一次，所有连接共享同一个文本帧。任务事件传入 seq=(prev_seq, seq)，
+        序号会写进消息并记入事件日志。
+        """
+        if seq is not None:
+            message = {**message, "prev_seq": seq[0], "seq": seq[1]}
+        frame = encode_json(message)
+        key = coalesce_key(message)
+        self._deliver_local(room_id, frame, key, seq)
+        await self.backplane.publish(room_id, frame, key, seq)
+
+    def _deliver_local(self, room_id: str, frame: str, key: Optional[str], seq: EventSeq = None):
+        if seq is not None:
+            self.event_log.append(room_id, seq[0], seq[1], frame)
         if room_id in self.active_connections:
-            for connection in self.active_connections[room_id].values():
-                await connection.send_json(message)
+            for connection in list(self.active_connections[room_id]):
+                connection.enqueue(frame, key)
 
     def get_active_users(self, room_id: str) -> Set[str]:
-        if room_id in self.active_connections:
-            return set(self.active_connections[room_id].keys())
-        return set()
\ No newline at end of file
+        return set(self.presence.get(room_id, ()))
+
+    def presence_snapshot(self, rooms: Optional[Set[str]] = None) -> Dict[str, List[str]]:
+        """指定房间（默认所有有人在线的房间）的在线用户，用于写入数据库"""
+        if rooms is None:
+            rooms = set(self.presence)
+        return {room_id: sorted(self.presence.get(room_id, ())) for room_id in rooms}
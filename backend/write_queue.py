@@ -0,0 +1,135 @@
+"""
+写操作的组提交（group commit）
+
+SQLite每次提交都要fsync并占用全局写锁。开启后，并发到达的写操作会在一个很短的
+时间窗口内（或攒够一定数量后）合并到同一个事务中提交，每个调用方仍然拿到自己
+那一个操作的结果。单个操作失败只回滚它自己的savepoint，不影响同批次的其他操作。
+"""
+
+import os
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+import aiosqlite
+
+DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "0") == "1"
+# 收集一个批次的最长等待时间（毫秒）
+DB_GROUP_COMMIT_WINDOW_MS = float(os.getenv("DB_GROUP_COMMIT_WINDOW_MS", "2"))
+DB_GROUP_COMMIT_MAX_BATCH = int(os.getenv("DB_GROUP_COMMIT_MAX_BATCH", "64"))
+
+# 写操作：在给定连接上执行语句并返回结果，不能自己提交
+WriteOp = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+class WriteQueue:
+    """单写者批量提交服务"""
+
+    def __init__(
+        self,
+        pool,
+        window_ms: float = DB_GROUP_COMMIT_WINDOW_MS,
+        max_batch: int = DB_GROUP_COMMIT_MAX_BATCH,
+    ):
+        self.pool = pool
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+        self.operations = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def depth(self) -> int:
+        """等待提交的写操作数"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.is_running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("写队列已停止"))
+
+    async def submit(self, op: WriteOp) -> Any:
+        """提交一个写操作，等到它所在的批次提交后返回该操作的结果"""
+        if not self.is_running:
+            raise RuntimeError("写队列未启动")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((op, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._commit(batch)
+
+    async def _commit(self, batch: List[Tuple[WriteOp, asyncio.Future]]):
+        outcomes = []
+        try:
+            async with self.pool.writer() as db:
+                await db.execute("BEGIN IMMEDIATE")
+                for op, future in batch:
+                    if future.done():
+                        # 调用方已取消
+                        continue
+                    await db.execute("SAVEPOINT write_op")
+                    try:
+                        result = await op(db)
+                    except Exception as e:
+                        await db.execute("ROLLBACK TO write_op")
+                        await db.execute("RELEASE write_op")
+                        outcomes.append((future, e, None))
+                    else:
+                        await db.execute("RELEASE write_op")
+                        outcomes.append((future, None, result))
+                await db.commit()
+        except asyncio.CancelledError:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("写队列已停止"))
+            raise
+        except Exception as e:
+            # 整个批次提交失败，所有操作都没有生效
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.operations += len(outcomes)
+        for future, error, result in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
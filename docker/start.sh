@@ -8,5 +8,13 @@ chmod -R 755 /var/www/html
 cd /app/backend
 python init_db.py
 
+# 后端worker数量；多于一个worker时通过Unix socket backplane同步WebSocket事件
+export BACKEND_WORKERS=${BACKEND_WORKERS:-2}
+if [ "$BACKEND_WORKERS" -gt 1 ]; then
+    export BACKPLANE=${BACKPLANE:-unix}
+else
+    export BACKPLANE=${BACKPLANE:-local}
+fi
+
 # 启动supervisor管理的服务
 exec /usr/bin/supervisord -c /etc/supervisor/conf.d/supervisord.conf
\ No newline at end of file
@@ -39,6 +39,33 @@ export interface TaskUpdate {
     description?: string;
 }
 
+export interface TaskChanges {
+    cursor: number;
+    reset: boolean;
+    tasks: Task[];
+    deleted: number[];
+}
+
+export interface TaskBatchOperation extends TaskUpdate {
+    op: 'create' | 'update' | 'delete' | 'restore';
+    task_id?: number;
+    creator?: string;
+    permanent?: boolean;
+}
+
+export interface TaskBatchResult {
+    index: number;
+    status: 'ok' | 'not_found' | 'invalid';
+    task_id?: number;
+    task?: Task;
+    error?: string;
+}
+
+export interface TagCount {
+    tag: string;
+    count: number;
+}
+
 export interface Room {
     id: number;
     token: string;
@@ -96,6 +123,31 @@ export async function getRoomTasks(roomId: string): Promise<Task[]> {
     });
 }
 
+// 增量获取任务变更（不传since时返回全量快照）
+export async function getTaskChanges(roomId: string, since?: number): Promise<TaskChanges> {
+    const query = since === undefined ? '' : `?since=${since}`;
+    return request<TaskChanges>({
+        url: `${API_BASE}/rooms/${roomId}/changes${query}`,
+        method: 'GET'
+    });
+}
+
+// 房间内的标签及任务数
+export async function getTagCounts(roomId: string): Promise<TagCount[]> {
+    return request<TagCount[]>({
+        url: `${API_BASE}/rooms/${roomId}/tags`,
+        method: 'GET'
+    });
+}
+
+// 按标签筛选任务
+export async function getTasksByTag(roomId: string, tag: string): Promise<Task[]> {
+    return request<Task[]>({
+        url: `${API_BASE}/rooms/${roomId}/tags/${encodeURIComponent(tag)}/tasks`,
+        method: 'GET'
+    });
+}
+
 // 创建新任务
 export async function createTask(task: TaskCreate): Promise<Task> {
     return request<Task>({
@@ -129,6 +181,16 @@ export async function deleteTask(taskId: number, permanent: boolean = false): Pr
     });
 }
 
+// 批量操作（全部完成、清空已完成、清空垃圾桶、批量导入等）
+export async function applyTaskBatch(roomId: string, operations: TaskBatchOperation[]): Promise<TaskBatchResult[]> {
+    const response = await request<{ results: TaskBatchResult[] }>({
+        url: `${API_BASE}/rooms/${roomId}/tasks/batch`,
+        method: 'POST',
+        data: { operations }
+    });
+    return response.results;
+}
+
 export async function getTrashTasks(roomId: string): Promise<Task[]> {
     return request<Task[]>({
         url: `${API_BASE}/rooms/${roomId}/trash`,
@@ -157,12 +219,26 @@ export function startPolling(roomId: string, onUpdate: (tasks: Task[]) => void)
     pollingStatus.value = 'polling';
     console.log('开始轮询任务列表');
 
+    // 本地维护任务副本，每次只拉取上次cursor之后的变更
+    const known = new Map<number, Task>();
+    let cursor: number | undefined = undefined;
+
     async function poll() {
         if (!isPolling) return;
 
         try {
-            const tasks = await getRoomTasks(roomId);
-            onUpdate(tasks);
+            const changes = await getTaskChanges(roomId, cursor);
+            if (changes.reset) {
+                known.clear();
+            }
+            changes.tasks.forEach((task) => known.set(task.id, task));
+            changes.deleted.forEach((taskId) => known.delete(taskId));
+            const changed = changes.reset || changes.tasks.length > 0 || changes.deleted.length > 0;
+            cursor = changes.cursor;
+            if (changed) {
+                const tasks = Array.from(known.values()).sort((a, b) => b.created_at.localeCompare(a.created_at));
+                onUpdate(tasks);
+            }
         } catch (error) {
             console.error('轮询任务列表失败:', error);
             uni.showToast({